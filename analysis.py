@@ -0,0 +1,377 @@
+import assemblyai as aai
+import hashlib
+import inspect
+import json
+from cache import cached_stage, code_fingerprint
+from ratelimit import limiter, with_backoff
+from retrieval import relevant_text
+from routing import stage_route
+from backend import get_backend
+import metrics
+from metrics import instrumented
+from jsonstream import JsonArrayStream
+from compact import encode_grading_input
+from matching import align_items, match_items, restore_answers
+
+def transcription_config(**kwargs):
+    # speaker labels let segment.py pull out the questions and answers without a LeMUR call
+    return aai.TranscriptionConfig(speaker_labels=True, **kwargs)
+
+# a rejected submission created nothing, so only rate-limit errors are safe to retry here
+@with_backoff(rate_limited_only=True)
+def submit_transcription(file, api_key=None, config=None):
+    if hasattr(file, 'seek'):
+        # a retried upload has to send the file from the start again
+        file.seek(0)
+    return get_backend().submit(file, api_key, config or transcription_config()).id
+
+@instrumented('transcribe_file')
+def transcribe_file(file, api_key=None):
+    print('starting transcribe')
+    transcript_id = submit_transcription(file, api_key)
+    wait_for_transcript(transcript_id, api_key)
+    print(f'File {file} Transcript Id: {transcript_id}')
+    return transcript_id
+
+def valid_grade(value):
+    try:
+        return 1 <= int(value) <= 5
+    except (TypeError, ValueError):
+        return False
+
+def non_empty(value):
+    return isinstance(value, str) and value.strip() != ''
+
+# items of each stage's JSON response that are missing a field are dropped and re-requested
+QUESTION_SCHEMA = {'question': non_empty, 'answer': str}
+SKILL_SCHEMA = {'question': non_empty, 'skill': non_empty}
+GRADE_SCHEMA = {'question': non_empty, 'grade': valid_grade}
+FUSED_SCHEMA = {'question': non_empty, 'skill': non_empty, 'candidate_grade': valid_grade, 'interviewer_grade': valid_grade}
+
+INTERVIEWER_CONTEXT = "you are the interviewer on this meeting. your job is to write a fact-based candidate summary for the hiring manager to review. do not include any opinions or details that are not directly from the interview. Focus the summary on the candidate background and motiviations for the role"
+# prompt text shared by the grading stages; {q_and_a_json} is filled in by encode_grading_input
+ID_INSTRUCTION = 'Every object in the array has an "id"; copy it unchanged into the object you return for that question.'
+CANDIDATE_RUBRIC = '''
+    Rubric:
+    5: Excellent
+    4: Good
+    3: Mediocre
+    2: Bad
+    1: Terrible
+'''
+INTERVIEWER_RUBRIC = '''
+    Rubric:
+    5: Very Necessary
+    4: Critical
+    3: Optional
+    2: Unneccessary
+    1: Completely Irrelevant
+'''
+RELEVANCE_GUIDANCE = '''
+    Avoid assigning low grades unless the questions lack relevance to the job description.
+    Questions pertaining to soft skills and background, such as "tell me about yourself" and "how do you work in teams," should be considered essential.'''
+
+
+def make_signature(*names, **defaults):
+    kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+    return inspect.Signature([inspect.Parameter(name, kind) for name in names] +
+                             [inspect.Parameter(name, kind, default=value) for name, value in defaults.items()])
+
+
+class LemurStage:
+    # One LeMUR analysis, declared as data: the arguments it takes, a prompt template filled
+    # from those arguments, the endpoint, and the schema its JSON answer must match (None for
+    # free text). run_lemur_stage does everything else the same way for every stage.
+    def __init__(self, name, signature, endpoint='task', prompt=None, schema=None, required=False, options=None,
+                 questions=None):
+        self.name = name
+        self.signature = signature
+        self.endpoint = endpoint
+        self.prompt = prompt
+        self.schema = schema
+        # an empty array is an error (and retried) instead of a valid "nothing found"
+        self.required = required
+        self.options = options or {}
+        self.questions = questions or []
+        # model(s) and output budget, from routing.py's config
+        self.route = stage_route(name)
+
+    @property
+    def reads(self):
+        # the inputs besides the transcript, e.g. ('jd', 'skills', 'q_and_a_arr')
+        return tuple(name for name in self.signature.parameters if name not in ('transcript_id', 'transcript_text', 'api_key'))
+
+    @property
+    def grading(self):
+        return 'q_and_a_arr' in self.signature.parameters
+
+    def fingerprint(self):
+        # cache entries follow the definition, so editing a prompt or option invalidates them
+        definition = [self.endpoint, self.prompt, sorted((self.schema or {}).keys()), self.required, self.options,
+                      self.questions, self.route, code_fingerprint(run_lemur_stage)]
+        return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode()).hexdigest()
+
+
+LEMUR_STAGES = {}
+
+
+def lemur_stage(stage):
+    # registers the stage and returns it as a plain function with the declared signature,
+    # wrapped in the same timing, caching and retry layers as every other stage
+    LEMUR_STAGES[stage.name] = stage
+
+    def run(*args, **kwargs):
+        bound = stage.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return run_lemur_stage(stage, bound.arguments)
+    run.__name__ = run.__qualname__ = stage.name
+    run.__signature__ = stage.signature
+    run.cache_fingerprint = stage.fingerprint()
+    return instrumented(stage.name)(cached_stage(stage.name)(with_backoff()(run)))
+
+
+class ResponseValidationError(ValueError):
+    # the request succeeded but the answer is unusable; the stage's route escalates to its next model
+    pass
+
+
+def send_lemur_request(stage, arguments, prompt, source, model):
+    api_key = arguments.get('api_key')
+    options = dict(stage.options, final_model=model, max_output_size=stage.route['max_output_size'])
+    if stage.endpoint == 'summarize':
+        return get_backend().summarize(api_key=api_key, **source, **options)
+    if stage.endpoint == 'question':
+        questions = [aai.LemurQuestion(**question) for question in stage.questions]
+        return get_backend().question(questions, api_key=api_key, **source, **options)
+    return get_backend().task(prompt=prompt, api_key=api_key, **source, **options)
+
+
+def check_response(stage, arguments, result):
+    if stage.schema is None:
+        if not result.response:
+            raise ResponseValidationError('empty response')
+        return result.response
+    print(result.response)
+    if '[' not in result.response:
+        raise ResponseValidationError('no JSON array in response')
+    items = parse_json(result.response, stage.schema)
+    if stage.required and not items:
+        raise ResponseValidationError(f'{stage.name} returned no items')
+    if stage.grading:
+        items = restore_answers(arguments['q_and_a_arr'], items)
+    return items
+
+
+def run_lemur_stage(stage, arguments):
+    try:
+        transcript_text = arguments.get('transcript_text')
+        values = dict(arguments)
+        if stage.grading:
+            # only the spans of the transcript that support these questions are sent
+            transcript_text = relevant_text(arguments['q_and_a_arr'], transcript_text)
+            values['q_and_a_json'], transcript_text = encode_grading_input(arguments['q_and_a_arr'], transcript_text)
+        prompt = stage.prompt.format(**values) if stage.prompt else None
+        # the text when there is one, otherwise LeMUR reads the transcript by id
+        source = {'input_text': transcript_text} if transcript_text else {'transcript_id': arguments.get('transcript_id')}
+        models = stage.route['models']
+        for n, model in enumerate(models):
+            if n > 0:
+                # an escalation is one more request for the shared limiter
+                limiter.acquire()
+            result = send_lemur_request(stage, arguments, prompt, source, model)
+            try:
+                return check_response(stage, arguments, result)
+            except ResponseValidationError as e:
+                metrics.note_invalid()
+                if n == len(models) - 1:
+                    raise
+                print(f'{stage.name}: {model} response did not validate ({e}), escalating to {models[n + 1]}')
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        print("Re-running LeMUR Request")
+        raise
+
+
+get_questions = lemur_stage(LemurStage(
+    'get_questions', make_signature('transcript_id', 'jd', 'api_key', transcript_text=None),
+    prompt='''
+        You are reading transcript of a job interview.
+
+        Here is the job description for that interview: <jd>{jd}</jd>
+
+        Please pull out questions asked by interviewer and responses of the candidate. 
+        Format the questions as if they were appearing on a test.
+
+        Return data in following JSON format: [{{"question":"<question>","answer":"<answer>"}}].
+    ''',
+    schema=QUESTION_SCHEMA, required=True,
+))
+
+get_skills = lemur_stage(LemurStage(
+    'get_skills', make_signature('transcript_id', 'jd', 'skills', 'api_key', 'q_and_a_arr', transcript_text=None),
+    prompt='''
+        You are reading transcript of a job interview.
+
+        Here is the job description for that interview: <jd>{jd}</jd>
+
+        Here is an array of the questions asked by the interviewer and the candidates answer in the transcript: {q_and_a_json}
+        Reference the transcript for a more complete understanding of the candidates answer.
+        ''' + ID_INSTRUCTION + '''
+
+        Tag each question and answer pair as relating to one of following skills:{skills}
+
+        Return data in following JSON format: [{{"id":"<id>","question":"<question>","answer":"<answer>", "skill":"<skill>"}}].
+    ''',
+    schema=SKILL_SCHEMA, required=True,
+))
+
+candidate_quality_assessment = lemur_stage(LemurStage(
+    'candidate_quality_assessment', make_signature('transcript_id', 'jd', 'skills', 'api_key', 'q_and_a_arr', transcript_text=None),
+    prompt='''
+        You are reading transcript of a job interview.
+
+        Here is the job description for that interview: <jd>{jd}</jd>
+
+        Here is an array of objects that each include a question asked by the interviewer, the candidates answer to the question, and the related skill: {q_and_a_json}
+        For each question, reference the transcript for a more complete understanding of the candidates answer.
+        ''' + ID_INSTRUCTION + '''
+
+        As a candidate assessor, please grade candidates answers to questions with an integer grade based on rubric below:''' + CANDIDATE_RUBRIC + '''
+        Return data in following JSON format: [{{"id":"<id>","question":"<question>","answer":"<answer>", "grade":"<grade>"}}].
+    ''',
+    schema=GRADE_SCHEMA,
+))
+
+interviewer_quality_assessment = lemur_stage(LemurStage(
+    'interviewer_quality_assessment', make_signature('transcript_id', 'jd', 'skills', 'api_key', 'q_and_a_arr', transcript_text=None),
+    prompt='''
+        You are reading a transcript of a job interview.
+
+        Here is the job description for that interview: <jd>{jd}</jd>
+
+        Here is an array of objects that each include a question asked by the interviewer, the candidates answer to the question, and the related skill: {q_and_a_json}
+        Reference the transcript for a more complete understanding of the candidates answer.
+        ''' + ID_INSTRUCTION + '''
+
+        As an interviewer assessor, your role involves evaluating the relevance of each question posed by the interviewer.''' + RELEVANCE_GUIDANCE + '''
+
+        Please grade the interviewers questions with an integer grade based on the rubric below:''' + INTERVIEWER_RUBRIC + '''
+        Return the data in the following JSON format: [{{"id":"<id>","question":"<question>", "grade":"<grade>"}}].
+    ''',
+    schema=GRADE_SCHEMA,
+))
+
+generate_summary_paragraph = lemur_stage(LemurStage(
+    'generate_summary_paragraph', make_signature('transcript_id', 'api_key', transcript_text=None), endpoint='summarize',
+    options={'context': INTERVIEWER_CONTEXT, 'answer_format': 'paragraph'},
+))
+
+generate_summary_topics = lemur_stage(LemurStage(
+    'generate_summary_topics', make_signature('transcript_id', 'api_key', transcript_text=None), endpoint='summarize',
+    options={'context': INTERVIEWER_CONTEXT, 'answer_format': '**<topic header>**\n<topic summary>\n'},
+))
+
+generate_summary_questions = lemur_stage(LemurStage(
+    'generate_summary_questions', make_signature('transcript_id', transcript_text=None, api_key=None), endpoint='summarize',
+    options={
+        'context': 'list the questions the interviewer asked the candidate. for each interview question, list the candidate response in bullet points',
+        'answer_format': '<Interview Question>,• <Candidate Response>',
+    },
+))
+
+generate_question_answer = lemur_stage(LemurStage(
+    'generate_question_answer', make_signature('transcript_id', 'api_key', transcript_text=None), endpoint='question',
+    questions=[
+        {'question': "what role is the candidate interviewing for?"},
+        {'question': "what is the candidate's relevant skills or background?"},
+        {'question': "how many years of relevant experience does the candidate? provide context for your answer?",
+         'answer_options': ["1-3", "4-7", "more than 7", "Unknown"]},
+        {'question': "what are the candidate's strengths and weaknesses?"},
+        {'question': "what questions did the candidate ask the interviewer?", 'answer_format': "bullet points"},
+    ],
+))
+
+# one call instead of get_skills + candidate_quality_assessment + interviewer_quality_assessment,
+# so the transcript and the Q&A array are only sent once
+fused_grading = lemur_stage(LemurStage(
+    'fused_grading', make_signature('transcript_id', 'jd', 'skills', 'api_key', 'q_and_a_arr', transcript_text=None),
+    prompt='''
+        You are reading a transcript of a job interview.
+
+        Here is the job description for that interview: <jd>{jd}</jd>
+
+        Here is an array of the questions asked by the interviewer and the candidates answer in the transcript: {q_and_a_json}
+        For each question, reference the transcript for a more complete understanding of the candidates answer.
+        ''' + ID_INSTRUCTION + '''
+
+        For every question and answer pair, do all three of the following:
+
+        1. Tag the pair as relating to one of following skills:{skills}
+
+        2. As a candidate assessor, grade the candidates answer with an integer grade based on rubric below:''' + CANDIDATE_RUBRIC + '''
+        3. As an interviewer assessor, grade the relevance of the interviewers question to the job description with an integer grade based on the rubric below.''' + RELEVANCE_GUIDANCE + INTERVIEWER_RUBRIC + '''
+        Keep the questions in the same order as the array above.
+        Return data in following JSON format: [{{"id":"<id>","question":"<question>","answer":"<answer>","skill":"<skill>","candidate_grade":"<grade>","interviewer_grade":"<grade>"}}].
+    ''',
+    schema=FUSED_SCHEMA,
+))
+
+def split_fused_grading(fused_arr, q_and_a_arr):
+    # returns (skills, candidate_assessment, interviewer_audit) in the shape the separate
+    # stages produce, or None if the fused output is incomplete and the caller should fall back
+    if not isinstance(fused_arr, list) or len(fused_arr) != len(q_and_a_arr):
+        return None
+    skills, candidate_assessment, interviewer_audit = [], [], []
+    for item in fused_arr:
+        if not isinstance(item, dict) or not item.get('question') or not item.get('skill'):
+            return None
+        if not valid_grade(item.get('candidate_grade')) or not valid_grade(item.get('interviewer_grade')):
+            return None
+        answer = item.get('answer', '')
+        ids = {'id': item['id']} if item.get('id') else {}
+        skills.append({**ids, 'question': item['question'], 'answer': answer, 'skill': item['skill']})
+        candidate_assessment.append({**ids, 'question': item['question'], 'answer': answer, 'grade': item['candidate_grade']})
+        interviewer_audit.append({**ids, 'question': item['question'], 'grade': item['interviewer_grade']})
+    return skills, candidate_assessment, interviewer_audit
+
+def parse_json(response_string, schema=None):
+    # keeps every valid object even when the array is cut off or one element is broken
+    stream = JsonArrayStream(schema)
+    items = stream.feed(response_string)
+    if stream.rejected or stream.truncated:
+        print(f"Recovered {len(items)} items, skipped {stream.rejected} invalid" + (" and a truncated tail" if stream.truncated else ""))
+    return items
+
+
+@with_backoff()
+def wait_for_transcript(transcript_id, api_key=None):
+    return get_backend().get_transcript(transcript_id, api_key)
+
+@instrumented('get_transcript_text')
+def get_transcript_text(transcript_id, api_key=None):
+    return wait_for_transcript(transcript_id, api_key).text
+
+def merge_skills(candidate_assessment, interviewer_audit, skills):
+    # skills are joined to the grades by question id (then question text), never by position,
+    # so a dropped or reordered item in one stage cannot shift every skill after it
+    for assessment in (candidate_assessment, interviewer_audit):
+        for item, match in zip(assessment, match_items(assessment, skills, pair_leftovers=False)):
+            if match is not None and skills[match].get('skill'):
+                item['skill'] = skills[match]['skill']
+
+MAX_REPAIR_ROUNDS = 2
+
+def fill_missing(request, q_and_a_arr, items):
+    # request(subset) runs the same grading stage on part of q_and_a_arr, so pairs the first
+    # response dropped or mangled are asked for again without re-running the whole stage
+    for _ in range(MAX_REPAIR_ROUNDS):
+        missing = [pair for pair, match in zip(q_and_a_arr, match_items(q_and_a_arr, items)) if match is None]
+        if not missing:
+            break
+        print(f"{len(missing)} of {len(q_and_a_arr)} items missing, re-requesting only those")
+        try:
+            items = items + request(missing)
+        except Exception as e:
+            print(f"Re-request failed: {e}")
+            break
+    return align_items(q_and_a_arr, items)
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import assemblyai as aai
+
+import metrics
+from compact import clean_transcript, compact_enabled, compact_prompt
+from ratelimit import install_hook
+
+# Point this at fake_server.py (e.g. http://127.0.0.1:8765) to run the whole app offline
+BASE_URL = os.environ.get('ASSEMBLYAI_BASE_URL', '')
+
+
+class AssemblyAIBackend:
+    # Every call the app makes to AssemblyAI goes through one of these methods, so the
+    # service behind them can be swapped (a local fake server, a recorder, a mock) in one place.
+    def __init__(self, base_url=BASE_URL, polling_interval=None, max_transcripts=64):
+        self.base_url = base_url
+        self.polling_interval = polling_interval
+        self.max_transcripts = max_transcripts
+        self._clients = {}
+        self._transcripts = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def client(self, api_key=None):
+        # one SDK client (and so one pooled keep-alive httpx connection pool) per API key,
+        # shared by every stage and every interview instead of rebuilt on settings changes
+        api_key = api_key or aai.settings.api_key
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                update = {'api_key': api_key}
+                if self.base_url:
+                    update['base_url'] = self.base_url
+                if self.polling_interval is not None:
+                    update['polling_interval'] = self.polling_interval
+                client = aai.Client(settings=aai.settings.copy(update=update))
+                install_hook(client)
+                self._clients[api_key] = client
+        return client
+
+    def lemur(self, transcript_id=None, api_key=None):
+        client = self.client(api_key)
+        if transcript_id is None:
+            return aai.Lemur(client=client)
+        return aai.Lemur(sources=[aai.LemurSource(self.get_transcript(transcript_id, api_key))], client=client)
+
+    def compact(self, prompt, input_text):
+        # whitespace and filler are stripped from everything sent, whichever stage built it
+        if not compact_enabled():
+            return prompt, input_text
+        before = len(prompt or '') + len(input_text or '')
+        prompt = compact_prompt(prompt) if prompt else prompt
+        input_text = clean_transcript(input_text) if input_text else input_text
+        metrics.note_saved(before - len(prompt or '') - len(input_text or ''))
+        return prompt, input_text
+
+    def task(self, prompt, transcript_id=None, input_text=None, api_key=None, **kwargs):
+        prompt, input_text = self.compact(prompt, input_text)
+        start = time.perf_counter()
+        if input_text:
+            result = self.lemur(api_key=api_key).task(prompt=prompt, input_text=input_text, **kwargs)
+        else:
+            result = self.lemur(transcript_id, api_key).task(prompt=prompt, **kwargs)
+        return self.record(result, prompt, input_text, kwargs.get('final_model'), start)
+
+    def summarize(self, transcript_id=None, input_text=None, api_key=None, **kwargs):
+        _, input_text = self.compact(None, input_text)
+        start = time.perf_counter()
+        if input_text:
+            result = self.lemur(api_key=api_key).summarize(input_text=input_text, **kwargs)
+        else:
+            result = self.lemur(transcript_id, api_key).summarize(**kwargs)
+        return self.record(result, kwargs.get('context'), input_text, kwargs.get('final_model'), start)
+
+    def question(self, questions, transcript_id=None, input_text=None, api_key=None, **kwargs):
+        _, input_text = self.compact(None, input_text)
+        start = time.perf_counter()
+        if input_text:
+            result = self.lemur(api_key=api_key).question(questions, input_text=input_text, **kwargs)
+        else:
+            result = self.lemur(transcript_id, api_key).question(questions, **kwargs)
+        return self.record(result, ' '.join(q.question for q in questions), input_text, kwargs.get('final_model'), start)
+
+    def record(self, result, prompt, input_text, model=None, start=None):
+        seconds = time.perf_counter() - start if start is not None else 0.0
+        metrics.note_request(len(prompt or '') + len(input_text or ''), len(str(result.response)), getattr(result, 'usage', None),
+                             model=model, seconds=seconds)
+        return result
+
+    def transcribe(self, file, api_key=None):
+        return aai.Transcriber(client=self.client(api_key)).transcribe(file)
+
+    def submit(self, file, api_key=None, config=None):
+        return aai.Transcriber(client=self.client(api_key)).submit(file, config)
+
+    def transcript_status(self, transcript_id, api_key=None):
+        # a single status request, no waiting; the transcription queue polls with this
+        return aai.api.get_transcript(self.client(api_key).http_client, transcript_id)
+
+    def get_transcript(self, transcript_id, api_key=None):
+        # single flight: concurrent stages asking for the same transcript share one fetch,
+        # and completed transcripts are kept for the rest of the process. Entries are per API
+        # key, so one user's key never serves another user's transcript.
+        key = (api_key or aai.settings.api_key, transcript_id)
+        with self._lock:
+            transcript = self._transcripts.get(key)
+            if transcript is not None:
+                self._transcripts.move_to_end(key)
+                return transcript
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            transcript = aai.Transcript(transcript_id, client=self.client(api_key)).wait_for_completion()
+        except Exception as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if transcript.status == aai.TranscriptStatus.completed:
+                self._transcripts[key] = transcript
+                while len(self._transcripts) > self.max_transcripts:
+                    self._transcripts.popitem(last=False)
+        future.set_result(transcript)
+        return transcript
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = AssemblyAIBackend()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
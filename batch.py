@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+from collections import Counter
+from pathlib import Path
+
+import assemblyai as aai
+
+import metrics
+
+from batching import SUMMARY_BATCH_SIZE, SummaryBatcher
+from jobs import get_queue
+from matching import calculateQualityScore
+from store import ResultStore, DEFAULT_STORE_PATH, job_title, to_jsonable
+from pipeline import run_pipeline, run_event_loop
+
+AUDIO_EXTENSIONS = {'.mp3', '.mp4', '.m4a', '.wav', '.flac', '.ogg', '.webm', '.aac', '.mov', '.mkv'}
+SUMMARY_COLUMNS = ['name', 'status', 'transcript_id', 'questions', 'candidate_score', 'interviewer_score', 'error']
+
+
+def safe_name(value):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', value).strip('_') or 'interview'
+
+
+def read_manifest(path):
+    path = Path(path)
+    if path.suffix == '.jsonl':
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    interviews = []
+    for row in rows:
+        transcript_id = (row.get('transcript_id') or '').strip()
+        url = (row.get('url') or '').strip()
+        if not transcript_id and not url:
+            print(f'Skipping manifest row without transcript_id or url: {row}')
+            continue
+        name = row.get('name') or transcript_id or Path(url).stem
+        interviews.append({'name': safe_name(name), 'transcript_id': transcript_id, 'source': url,
+                           'interviewer': (row.get('interviewer') or '').strip()})
+    return interviews
+
+
+def read_audio_dir(path):
+    files = [file for file in sorted(Path(path).iterdir()) if file.suffix.lower() in AUDIO_EXTENSIONS]
+    stems = Counter(safe_name(file.stem) for file in files)
+    # a.mp3 and a.wav would share one result file, so those keep their extension in the name
+    return [
+        {'name': safe_name(file.stem if stems[safe_name(file.stem)] == 1 else file.name), 'transcript_id': '',
+         'source': str(file), 'interviewer': ''}
+        for file in files
+    ]
+
+
+def duplicate_names(interviews):
+    # names shared by several interviews; all but the first would be skipped as already done
+    counts = Counter(interview['name'] for interview in interviews)
+    return sorted(name for name, count in counts.items() if count > 1)
+
+
+def write_json(path, data):
+    # write-then-rename so a killed run never leaves a half-written result behind
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def summary_row(name, result=None, error=None):
+    if result is None:
+        return {'name': name, 'status': 'error', 'transcript_id': '', 'questions': 0,
+                'candidate_score': '', 'interviewer_score': '', 'error': error}
+    return {
+        'name': name,
+        'status': 'ok',
+        'transcript_id': result['transcript_id'],
+        'questions': len(result['q_and_a_arr']),
+        'candidate_score': round(calculateQualityScore(result['parsed_candidate_assessment']) * 100, 1),
+        'interviewer_score': round(calculateQualityScore(result['parsed_interviewer_audit']) * 100, 1),
+        'error': '',
+    }
+
+
+async def process_interview(interview, jd, skills, api_key, out_dir, request_semaphore, fused=False, long_mode=None, store=None, job='', pipelined=False,
+                            batcher=None):
+    result_path = out_dir / f"{interview['name']}.json"
+    if result_path.exists():
+        print(f"Skipping {interview['name']}, result already exists")
+        with open(result_path) as f:
+            return json.load(f)
+
+    # remember transcript ids so a resumed run does not transcribe the same file twice
+    id_path = out_dir / '.transcripts' / f"{interview['name']}.txt"
+    transcript_id = interview['transcript_id']
+    if not transcript_id and id_path.exists():
+        transcript_id = id_path.read_text().strip()
+    if not transcript_id:
+        transcription = get_queue().submit(interview['source'], api_key, interview['name'])
+        transcript_id = await asyncio.wrap_future(transcription.future)
+        id_path.write_text(transcript_id)
+
+    result = await run_pipeline(transcript_id, jd, skills, api_key, semaphore=request_semaphore, fused=fused, long_mode=long_mode,
+                                pipelined=pipelined, batcher=batcher)
+    result = to_jsonable(result)
+    result['name'] = interview['name']
+    write_json(result_path, result)
+    if store is not None:
+        store.save(result, interview['name'], job, interviewer=interview.get('interviewer', ''))
+    return result
+
+
+async def run_interviews(interviews, jd, skills, api_key, out_dir, concurrency, max_requests, fused=False, long_mode=None, store=None, job='', pipelined=False,
+                         batcher=None):
+    # one event loop drives every interview; the interview semaphore bounds how many are in
+    # flight and the request semaphore bounds LeMUR calls across all of them
+    interview_semaphore = asyncio.Semaphore(concurrency)
+    request_semaphore = asyncio.Semaphore(max_requests)
+
+    async def run(interview):
+        async with interview_semaphore:
+            try:
+                result = await process_interview(interview, jd, skills, api_key, out_dir, request_semaphore, fused, long_mode, store, job, pipelined,
+                                                 batcher)
+                print(f"Finished {interview['name']}")
+                return summary_row(interview['name'], result)
+            except Exception as e:
+                print(f"Failed {interview['name']}: {e}")
+                return summary_row(interview['name'], error=str(e))
+
+    return await asyncio.gather(*(run(interview) for interview in interviews))
+
+
+def run_batch(interviews, jd, skills, api_key, out_dir, concurrency=4, max_requests=16, fused=False, long_mode=None, store=None, job='', pipelined=False,
+              summary_batch=SUMMARY_BATCH_SIZE):
+    out_dir = Path(out_dir)
+    (out_dir / '.transcripts').mkdir(parents=True, exist_ok=True)
+
+    # summaries of interviews in flight at the same time share multi-transcript requests
+    batcher = SummaryBatcher(summary_batch) if summary_batch > 1 and concurrency > 1 else None
+    try:
+        rows = run_event_loop(
+            run_interviews(interviews, jd, skills, api_key, out_dir, concurrency, max_requests, fused, long_mode, store, job, pipelined,
+                           batcher),
+            concurrency=concurrency + max_requests,
+        )
+    finally:
+        if batcher is not None:
+            batcher.close()
+
+    rows = sorted(rows, key=lambda row: row['name'])
+    with open(out_dir / 'summary.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def print_summary(rows):
+    widths = {c: max([len(c)] + [len(str(row[c])) for row in rows]) for c in SUMMARY_COLUMNS}
+    print('  '.join(c.ljust(widths[c]) for c in SUMMARY_COLUMNS))
+    for row in rows:
+        print('  '.join(str(row[c]).ljust(widths[c]) for c in SUMMARY_COLUMNS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze many interviews without the Streamlit UI.')
+    parser.add_argument('--audio-dir', help='folder of audio/video files to transcribe and analyze')
+    parser.add_argument('--manifest', help='CSV or JSONL file with name, transcript_id and/or url (and optionally interviewer) columns')
+    parser.add_argument('--jd', required=True, help='file containing the job description')
+    parser.add_argument('--skills', required=True, help='file containing the skills list')
+    parser.add_argument('--out', default='batch_results', help='output folder for per-interview JSON and summary.csv')
+    parser.add_argument('--concurrency', type=int, default=4, help='number of interviews analyzed at once')
+    parser.add_argument('--max-requests', type=int, default=16, help='number of LeMUR requests in flight across all interviews')
+    parser.add_argument('--fused', action='store_true', help='grade skills, candidate and interviewer in one LeMUR call per interview')
+    parser.add_argument('--pipelined', action='store_true', help='grade each transcript chunk while the rest are still being extracted')
+    parser.add_argument('--summary-batch', type=int, default=SUMMARY_BATCH_SIZE,
+                        help='interviews whose summaries and basic Q&A share one LeMUR request (1 to send them separately)')
+    parser.add_argument('--long-mode', choices=['auto', 'on', 'off'], default='auto', help='analyze transcripts chunk by chunk (auto: only long ones)')
+    parser.add_argument('--job', help='job name to file the results under (defaults to the first line of the job description)')
+    parser.add_argument('--results-db', default=DEFAULT_STORE_PATH, help='SQLite results store shared with the UI; "" to skip it')
+    parser.add_argument('--metrics-out', help='write per-stage timing, retry and token records as JSON')
+    parser.add_argument('--prometheus-out', help='write per-stage metrics in Prometheus text format')
+    parser.add_argument('--api-key', default=os.environ.get('ASSEMBLYAI_API_KEY', ''), help='AssemblyAI API key (defaults to $ASSEMBLYAI_API_KEY)')
+    args = parser.parse_args(argv)
+
+    if not args.audio_dir and not args.manifest:
+        parser.error('provide --audio-dir and/or --manifest')
+    if not args.api_key:
+        parser.error('provide --api-key or set ASSEMBLYAI_API_KEY')
+
+    interviews = []
+    if args.audio_dir:
+        interviews += read_audio_dir(args.audio_dir)
+    if args.manifest:
+        interviews += read_manifest(args.manifest)
+    duplicates = duplicate_names(interviews)
+    if duplicates:
+        parser.error(f"several interviews map to the same output name: {', '.join(duplicates)}; give them distinct names")
+
+    aai.settings.api_key = args.api_key
+    jd = Path(args.jd).read_text()
+    skills = Path(args.skills).read_text()
+
+    long_mode = {'auto': None, 'on': True, 'off': False}[args.long_mode]
+    store = ResultStore(args.results_db) if args.results_db else None
+    rows = run_batch(interviews, jd, skills, args.api_key, args.out, args.concurrency, args.max_requests, args.fused, long_mode,
+                     store, args.job or job_title(jd), args.pipelined, args.summary_batch)
+    print_summary(rows)
+
+    if args.metrics_out:
+        with open(args.metrics_out, 'w') as f:
+            f.write(metrics.recorder.to_json())
+    if args.prometheus_out:
+        with open(args.prometheus_out, 'w') as f:
+            f.write(metrics.recorder.to_prometheus())
+
+
+if __name__ == '__main__':
+    main()
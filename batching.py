@@ -0,0 +1,163 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from analysis import (LEMUR_STAGES, LemurStage, generate_question_answer, generate_summary_paragraph,
+                      generate_summary_topics, lemur_stage, make_signature, non_empty)
+
+# interviews per multi-transcript request; about 900 output tokens each, under max_output_size=4000
+SUMMARY_BATCH_SIZE = int(os.environ.get('SUMMARY_BATCH_SIZE', 4))
+# transcript characters per request; longer interviews are summarized on their own
+SUMMARY_BATCH_CHARS = int(os.environ.get('SUMMARY_BATCH_CHARS', 40000))
+# how long a request waits for more interviews to join before it is sent anyway
+SUMMARY_BATCH_WAIT = float(os.environ.get('SUMMARY_BATCH_WAIT', 0.5))
+MAX_PARALLEL_BATCHES = 4
+# pipeline stage name -> the single-interview stage it replaces
+BATCHED_STAGES = {
+    'summary_paragraph': 'generate_summary_paragraph',
+    'summary_topics': 'generate_summary_topics',
+    'question_answer': 'generate_question_answer',
+}
+
+PARAGRAPH = LEMUR_STAGES['generate_summary_paragraph'].options
+QUESTIONS = LEMUR_STAGES['generate_question_answer'].questions
+
+
+def question_lines():
+    lines = []
+    for n, question in enumerate(QUESTIONS, 1):
+        lines.append(f"Q{n}: {question['question']}")
+        if question.get('answer_options'):
+            lines.append(f"Answer with one of: {', '.join(question['answer_options'])}")
+        if question.get('answer_format'):
+            lines.append(f"Answer format: {question['answer_format']}")
+    return '\n'.join(lines)
+
+
+def valid_answers(value):
+    return (isinstance(value, list) and len(value) == len(QUESTIONS)
+            and all(isinstance(a, dict) and non_empty(a.get('question')) and non_empty(a.get('answer')) for a in value))
+
+
+BATCH_SCHEMA = {'key': non_empty, 'summary_paragraph': non_empty, 'summary_topics': non_empty, 'question_answer': valid_answers}
+
+# the three summary stages for several short interviews in one request; every object in the
+# answer carries the key of its interview, so the results are split back per interview
+summarize_interviews = lemur_stage(LemurStage(
+    'summarize_interviews', make_signature('transcript_text', 'keys', 'api_key'),
+    prompt='''
+        You are reading the transcripts of several separate job interviews. Each transcript is wrapped in <interview key="..."> tags; the keys are: {keys}.
+        Treat every interview on its own and never mix details from one interview into another.
+
+        For every interview:
+
+        1. "summary_paragraph": ''' + PARAGRAPH['context'] + '''. Write it as a paragraph.
+
+        2. "summary_topics": the same summary as a list of topics, each one a "**<topic header>**" line followed by a line with the topic summary.
+
+        3. "question_answer": answer each of these questions about the interview:
+        ''' + question_lines().replace('\n', '\n        ') + '''
+
+        Return data in following JSON format, one object per interview key: [{{"key":"<key>","summary_paragraph":"<summary>","summary_topics":"<topics>","question_answer":[{{"question":"<question>","answer":"<answer>"}}]}}].
+    ''',
+    schema=BATCH_SCHEMA, required=True,
+))
+
+
+def summarize_one(transcript_id, text, api_key):
+    return {
+        'summary_paragraph': generate_summary_paragraph(transcript_id, api_key, text),
+        'summary_topics': generate_summary_topics(transcript_id, api_key, text),
+        'question_answer': generate_question_answer(transcript_id, api_key, text),
+    }
+
+
+def summarize_group(texts, api_key):
+    # one result dict per text, None where the response had no valid object for it
+    keys = [f'i{n + 1}' for n in range(len(texts))]
+    input_text = '\n'.join(f'<interview key="{key}">\n{text}\n</interview>' for key, text in zip(keys, texts))
+    items = {item['key']: item for item in summarize_interviews(input_text, ', '.join(keys), api_key)}
+    return [{'summary_paragraph': items[key]['summary_paragraph'], 'summary_topics': items[key]['summary_topics'],
+             'question_answer': [{'question': a['question'], 'answer': a['answer']} for a in items[key]['question_answer']]}
+            if key in items else None for key in keys]
+
+
+class SummaryBatcher:
+    # Collects the summary stages of interviews analyzed at the same time (a batch run) and sends
+    # them as multi-transcript requests: a request goes out when it is full or SUMMARY_BATCH_WAIT
+    # after its first interview arrived. Interviews missing from a response are split into halves
+    # and sent again; a single interview falls back to the three regular stages.
+    def __init__(self, batch_size=SUMMARY_BATCH_SIZE, max_chars=SUMMARY_BATCH_CHARS, wait=SUMMARY_BATCH_WAIT):
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.wait = wait
+        # api key -> [(transcript_id, text, future)]; only interviews under one key share a request
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_BATCHES, thread_name_prefix='summary-batch')
+
+    def submit(self, transcript_id, text, api_key):
+        future = Future()
+        if len(text) > self.max_chars // 2:
+            self._executor.submit(self._run_one, transcript_id, text, api_key, future)
+            return future
+        with self._lock:
+            pending = self._pending.setdefault(api_key, [])
+            if pending and sum(len(t) for _, t, _ in pending) + len(text) > self.max_chars:
+                self._flush_locked(api_key)
+                pending = self._pending.setdefault(api_key, [])
+            pending.append((transcript_id, text, future))
+            if len(pending) >= self.batch_size:
+                self._flush_locked(api_key)
+            elif api_key not in self._timers:
+                timer = self._timers[api_key] = threading.Timer(self.wait, self.flush, (api_key,))
+                timer.daemon = True
+                timer.start()
+        return future
+
+    def flush(self, api_key):
+        with self._lock:
+            self._flush_locked(api_key)
+
+    def _flush_locked(self, api_key):
+        timer = self._timers.pop(api_key, None)
+        if timer is not None:
+            timer.cancel()
+        group = self._pending.pop(api_key, [])
+        if group:
+            self._executor.submit(self._run_group, group, api_key)
+
+    def _run_one(self, transcript_id, text, api_key, future):
+        try:
+            future.set_result(summarize_one(transcript_id, text, api_key))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _run_group(self, group, api_key):
+        if len(group) == 1:
+            self._run_one(*group[0][:2], api_key, group[0][2])
+            return
+        try:
+            results = summarize_group([text for _, text, _ in group], api_key)
+        except Exception as e:
+            print(f'Batched summary of {len(group)} interviews failed: {e}')
+            results = [None] * len(group)
+        failed = []
+        for entry, result in zip(group, results):
+            if result is None:
+                failed.append(entry)
+            else:
+                entry[2].set_result(result)
+        if failed:
+            print(f'Batched summary: {len(failed)} of {len(group)} interviews missing, splitting')
+            half = (len(failed) + 1) // 2
+            for part in (failed[:half], failed[half:]):
+                if part:
+                    self._run_group(part, api_key)
+
+    def close(self):
+        with self._lock:
+            for api_key in list(self._pending):
+                self._flush_locked(api_key)
+        self._executor.shutdown(wait=True)
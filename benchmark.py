@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+import assemblyai as aai
+
+import backend
+import fake_server
+import metrics
+import ratelimit
+from analysis import transcribe_file
+from batching import SummaryBatcher
+from pipeline import run_pipeline, run_event_loop
+
+STAGE_ORDER = [
+    'end_to_end', 'transcribe_file', 'get_transcript_text', 'get_questions', 'get_questions_chunk', 'fused_grading', 'get_skills',
+    'candidate_quality_assessment', 'interviewer_quality_assessment', 'generate_summary_paragraph',
+    'generate_summary_topics', 'generate_question_answer', 'summarize_interviews',
+]
+
+
+async def run_interviews(count, jd, skills, api_key, concurrency, max_requests, fused, transcribe, pipelined=False, batcher=None):
+    interview_semaphore = asyncio.Semaphore(concurrency)
+    request_semaphore = asyncio.Semaphore(max_requests)
+
+    async def run(i):
+        async with interview_semaphore:
+            if transcribe:
+                transcript_id = await asyncio.to_thread(transcribe_file, f'https://example.com/bench-{i}.mp3', api_key)
+            else:
+                # the fake server treats unknown transcript ids as finished transcripts
+                transcript_id = f'bench-{i}'
+            await run_pipeline(transcript_id, jd, skills, api_key, semaphore=request_semaphore, fused=fused, pipelined=pipelined,
+                               batcher=batcher)
+
+    # every interview runs to the end even when others fail; the failures are returned
+    results = await asyncio.gather(*(run(i) for i in range(count)), return_exceptions=True)
+    return [result for result in results if isinstance(result, BaseException)]
+
+
+def format_report(summary, elapsed, count):
+    lines = [f'{count} interviews in {elapsed:.2f}s ({count / elapsed * 60:.1f} interviews/min)', '']
+    header = f"{'stage':32} {'n':>5} {'err':>4} {'retry':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'in_tok':>9} {'out_tok':>8} {'saved':>7} {'cost':>8}"
+    lines.append(header)
+    lines.append('-' * len(header))
+    stages = [s for s in STAGE_ORDER if s in summary] + sorted(s for s in summary if s not in STAGE_ORDER)
+    for stage in stages:
+        s = summary[stage]
+        lines.append(
+            f"{stage:32} {s['count']:>5} {s['errors']:>4} {s['retries']:>5} {s['p50']:>8.3f} {s['p95']:>8.3f} "
+            f"{s['p99']:>8.3f} {s['input_tokens']:>9} {s['output_tokens']:>8} {s['saved_tokens']:>7} {s['cost']:>8.4f}"
+        )
+    return '\n'.join(lines)
+
+
+def format_routes(routes):
+    # latency and cost per model each stage was routed to, escalations included
+    header = f"{'stage':32} {'model':30} {'req':>5} {'invalid':>7} {'p50':>8} {'p95':>8} {'cost':>8}"
+    lines = ['', header, '-' * len(header)]
+    for r in sorted(routes, key=lambda r: (r['stage'], r['model'])):
+        lines.append(f"{r['stage']:32} {r['model']:30} {r['requests']:>5} {r['invalid']:>7} {r['p50']:>8.3f} "
+                     f"{r['p95']:>8.3f} {r['cost']:>8.4f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run N synthetic interviews through the pipeline and report per-stage latency.')
+    parser.add_argument('-n', '--interviews', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4, help='interviews in flight')
+    parser.add_argument('--max-requests', type=int, default=16, help='LeMUR requests in flight')
+    parser.add_argument('--fused', action='store_true')
+    parser.add_argument('--pipelined', action='store_true', help='grade each chunk while the rest are still being extracted')
+    parser.add_argument('--summary-batch', type=int, default=1,
+                        help='interviews whose summaries and basic Q&A share one LeMUR request, as in batch.py')
+    parser.add_argument('--transcribe', action='store_true', help='also submit and poll a transcription per interview')
+    parser.add_argument('--base-url', help='benchmark an already running server instead of starting fake_server in-process')
+    parser.add_argument('--lemur-latency', default='lognormal:-1.5,0.5', help='fake server LeMUR latency distribution')
+    parser.add_argument('--transcribe-latency', default='fixed:0.5')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='fake server seconds per LeMUR output token')
+    parser.add_argument('--questions', type=int, default=6, help='Q&A pairs in the fake server\'s synthetic transcripts')
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0)
+    parser.add_argument('--max-concurrent', type=int, default=0, help='fake server 429s above this many LeMUR requests in flight')
+    parser.add_argument('--rate', type=float, help='starting rate of the client rate limiter (requests/s)')
+    parser.add_argument('--use-cache', action='store_true', help='keep the LeMUR result cache on (off by default so every run hits the server)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='show the pipeline\'s own print output')
+    parser.add_argument('--json-out', help='write records and per-stage summary as JSON')
+    parser.add_argument('--prometheus-out', help='write per-stage metrics in Prometheus text format')
+    args = parser.parse_args(argv)
+
+    if not args.use_cache:
+        os.environ['LEMUR_CACHE'] = '0'
+    if args.rate:
+        ratelimit.limiter.rate = args.rate
+
+    base_url = args.base_url
+    if not base_url:
+        _, base_url, _ = fake_server.start_server(
+            lemur_latency=args.lemur_latency, transcribe_latency=args.transcribe_latency,
+            rate_limit_prob=args.rate_limit_prob, max_concurrent=args.max_concurrent, seed=args.seed,
+            token_latency=args.token_latency, num_questions=args.questions,
+        )
+    api_key = os.environ.get('ASSEMBLYAI_API_KEY', 'benchmark')
+    aai.settings.api_key = api_key
+    backend.set_backend(backend.AssemblyAIBackend(base_url=base_url, polling_interval=0.1))
+
+    metrics.recorder.clear()
+    batcher = SummaryBatcher(args.summary_batch) if args.summary_batch > 1 else None
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with quiet:
+            failures = run_event_loop(
+                run_interviews(args.interviews, 'Backend engineer', 'Python, Communication, System Design', api_key,
+                               args.concurrency, args.max_requests, args.fused, args.transcribe, args.pipelined, batcher),
+                concurrency=args.concurrency + args.max_requests,
+            )
+    if batcher is not None:
+        batcher.close()
+    elapsed = time.perf_counter() - start
+    if failures:
+        # a broken run is not a timing result
+        print(f'{len(failures)} of {args.interviews} interviews failed, first error:')
+        raise failures[0]
+
+    summary = metrics.recorder.summary()
+    print(format_report(summary, elapsed, args.interviews))
+    print(format_routes(metrics.recorder.route_summary()))
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            report = json.loads(metrics.recorder.to_json())
+            report['elapsed'] = elapsed
+            json.dump(report, f, indent=2)
+    if args.prometheus_out:
+        with open(args.prometheus_out, 'w') as f:
+            f.write(metrics.recorder.to_prometheus())
+
+
+if __name__ == '__main__':
+    main()
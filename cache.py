@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DEFAULT_CACHE_PATH = os.environ.get('LEMUR_CACHE_PATH', '.lemur_cache.sqlite')
+DEFAULT_TTL_SECONDS = int(os.environ.get('LEMUR_CACHE_TTL', 7 * 24 * 60 * 60))
+DEFAULT_MAX_BYTES = int(os.environ.get('LEMUR_CACHE_MAX_MB', 200)) * 1024 * 1024
+
+# arguments that never change a LeMUR result and must not end up in the key
+IGNORED_ARGS = ('api_key',)
+
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)')
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, created_at FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, stage, value):
+        blob = pickle.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (key, stage, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, stage, blob, len(blob), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute('DELETE FROM results WHERE created_at < ?', (now - self.ttl,))
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # least recently used entries go first
+        for key, size in self._conn.execute('SELECT key, size FROM results ORDER BY accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM results')
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResultCache()
+    return _default_cache
+
+
+def cache_enabled():
+    return os.environ.get('LEMUR_CACHE', '1') != '0'
+
+
+def code_fingerprint(fn):
+    # prompts and final_model are literals inside each stage function, so hashing
+    # the compiled code and its constants invalidates entries whenever a prompt changes;
+    # registry stages (analysis.LemurStage) hash their definition instead
+    fn = inspect.unwrap(fn)
+    if hasattr(fn, 'cache_fingerprint'):
+        return fn.cache_fingerprint
+    code = fn.__code__
+    return hashlib.sha256(code.co_code + repr(code.co_consts).encode()).hexdigest()
+
+
+def make_key(stage, fingerprint, arguments):
+    arguments = {k: v for k, v in arguments.items() if k not in IGNORED_ARGS}
+    if arguments.get('transcript_text'):
+        # the text is what LeMUR sees; the id is only a placeholder in that case
+        arguments.pop('transcript_id', None)
+    payload = json.dumps([stage, fingerprint, arguments], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached_stage(stage):
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        fingerprint = code_fingerprint(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not cache_enabled():
+                return fn(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = make_key(stage, fingerprint, dict(bound.arguments))
+            cache = get_cache()
+            result = cache.get(key)
+            if result is not None:
+                print(f'Cache hit for {stage}')
+                metrics.note_cache_hit()
+                return result
+            result = fn(*args, **kwargs)
+            # empty results are failures, keep retrying them on the next run
+            if result:
+                cache.set(key, stage, result)
+            return result
+        return wrapper
+    return decorator
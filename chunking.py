@@ -0,0 +1,219 @@
+import difflib
+import os
+from concurrent.futures import as_completed
+
+from analysis import QUESTION_SCHEMA, LemurStage, lemur_stage, make_signature
+from compact import split_turns
+from fanout import FanOut
+from matching import align_items, assign_question_ids, normalize_question
+from retrieval import RETRIEVAL_TOP_K, span_batches
+from segment import sentences
+
+# transcripts longer than this are analyzed chunk by chunk (about 15k tokens)
+LONG_TRANSCRIPT_CHARS = int(os.environ.get('LONG_TRANSCRIPT_CHARS', 60000))
+WINDOW_CHARS = 16000
+# pipelined mode cuts even short transcripts into windows this size so grading can start early
+PIPELINE_WINDOW_CHARS = int(os.environ.get('PIPELINE_WINDOW_CHARS', 6000))
+OVERLAP_CHARS = 2000
+# estimated output tokens per grading request, kept well under max_output_size=4000
+GRADING_OUTPUT_TOKENS = 2500
+MAX_PARALLEL_REQUESTS = 4
+# pipelined mode wants every chunk extracting at once; the shared rate limiter still applies
+MAX_PARALLEL_EXTRACTIONS = 8
+DUPLICATE_RATIO = 0.85
+
+
+def is_long_transcript(text, long_mode=None):
+    if long_mode is not None:
+        return long_mode
+    return len(text or '') > LONG_TRANSCRIPT_CHARS
+
+
+def split_transcript(text, window_chars=WINDOW_CHARS, overlap_chars=OVERLAP_CHARS):
+    # windows never cut a turn in half, and each one repeats the last turns of the
+    # previous window so a question and its answer always land in the same chunk
+    turns = split_turns(text)
+    chunks = []
+    start = 0
+    while start < len(turns):
+        end = start
+        size = 0
+        while end < len(turns) and (end == start or size + len(turns[end]) <= window_chars):
+            size += len(turns[end]) + 1
+            end += 1
+        chunks.append('\n'.join(turns[start:end]))
+        if end >= len(turns):
+            break
+        back = end
+        overlap = 0
+        while back > start + 1 and overlap < overlap_chars:
+            back -= 1
+            overlap += len(turns[back])
+        start = back
+    return chunks
+
+
+# a chunk without questions is a valid result, unlike for the whole transcript
+get_chunk_questions = lemur_stage(LemurStage(
+    'get_questions_chunk', make_signature('transcript_text', 'jd', 'api_key', 'part', 'parts'),
+    prompt='''
+        You are reading part {part} of {parts} of a transcript of a job interview.
+        The part may start or end in the middle of a conversation.
+
+        Here is the job description for that interview: <jd>{jd}</jd>
+
+        Please pull out questions asked by interviewer and responses of the candidate in this part.
+        Skip a question if its answer is cut off at the end of this part.
+        Format the questions as if they were appearing on a test.
+
+        Return data in following JSON format: [{{"question":"<question>","answer":"<answer>"}}].
+        If this part contains no interview questions, return [].
+    ''',
+    schema=QUESTION_SCHEMA,
+))
+
+
+class QuestionMerger:
+    # Neighbouring chunks overlap, so the same question can come back twice; keep the first one
+    # but take the longer answer, since the earlier chunk may have cut it short. Chunks can be
+    # added in any order, and add() returns only the questions that were not seen before.
+    def __init__(self):
+        self.items = []
+        self.keys = []
+
+    def add(self, chunk_index, items):
+        new_items = []
+        for position, item in enumerate(items):
+            key = normalize_question(item['question'])
+            # reworded repeats are only looked for in the neighbouring chunks, where the overlap
+            # is; elsewhere two similar questions are more likely two different questions
+            duplicate = next((i for i, k in enumerate(self.keys)
+                              if k == key or abs(self.items[i][0] - chunk_index) == 1
+                              and difflib.SequenceMatcher(None, key, k).ratio() >= DUPLICATE_RATIO), None)
+            if duplicate is None:
+                merged = {'question': item['question'], 'answer': item['answer'], 'chunk': chunk_index}
+                self.items.append((chunk_index, position, merged))
+                self.keys.append(key)
+                new_items.append(merged)
+            elif len(item['answer']) > len(self.items[duplicate][2]['answer']):
+                self.items[duplicate][2]['answer'] = item['answer']
+        # ids are handed out as questions arrive, so gradings submitted early already carry them
+        assign_question_ids([entry[2] for entry in self.items])
+        return new_items
+
+    def merged(self):
+        # transcript order, whatever order the chunks finished in
+        return [item for _, _, item in sorted(self.items, key=lambda entry: entry[:2])]
+
+
+def merge_questions(chunk_results):
+    merger = QuestionMerger()
+    for chunk_index, items in enumerate(chunk_results):
+        merger.add(chunk_index, items)
+    return merger.merged()
+
+
+def extract_questions_chunked(text, jd, api_key):
+    chunks = split_transcript(text)
+    print(f'Long transcript: extracting questions from {len(chunks)} chunks')
+    with FanOut(MAX_PARALLEL_REQUESTS) as executor:
+        futures = [executor.submit(get_chunk_questions, chunk, jd, api_key, i + 1, len(chunks)) for i, chunk in enumerate(chunks)]
+        chunk_results = [future.result() for future in futures]
+    q_and_a_arr = merge_questions(chunk_results)
+    if not q_and_a_arr:
+        raise ValueError('q_and_a_arr is empty')
+    return q_and_a_arr
+
+
+def assign_chunks(q_and_a_arr, text):
+    # questions that did not come from chunked extraction (speaker segmentation) still need the
+    # chunk grade_in_batches sends with them: the first one, in transcript order, holding the question
+    chunks = split_transcript(text)
+    start = 0
+    for item in q_and_a_arr:
+        lead = sentences(item['question'])[0]
+        start = next((i for i in range(start, len(chunks)) if lead in chunks[i]), start)
+        item['chunk'] = start
+    return q_and_a_arr
+
+
+def estimate_output_tokens(item):
+    # graders echo the question and answer back, plus a few tokens of JSON and grade
+    return (len(item['question']) + len(item['answer'])) // 4 + 20
+
+
+def batch_questions(q_and_a_arr, output_tokens=GRADING_OUTPUT_TOKENS):
+    batches = []
+    current = []
+    size = 0
+    for item in q_and_a_arr:
+        tokens = estimate_output_tokens(item)
+        if current and size + tokens > output_tokens:
+            batches.append(current)
+            current = []
+            size = 0
+        current.append(item)
+        size += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def strip_chunk(batch):
+    return [{'id': item['id'], 'question': item['question'], 'answer': item['answer']} if item.get('id')
+            else {'question': item['question'], 'answer': item['answer']} for item in batch]
+
+
+def grade_in_batches(grade, q_and_a_arr, text):
+    # grade(batch, batch_text) is one of the regular grading stages. With retrieval on, each
+    # batch is sent with the whole transcript, from which the grading stage keeps only the spans
+    # supporting that batch; otherwise each batch is sent with the chunks its questions came from
+    if RETRIEVAL_TOP_K:
+        return grade_batches(grade, [(strip_chunk(batch), text) for output_batch in batch_questions(q_and_a_arr)
+                                     for batch in span_batches(output_batch, text)])
+    chunks = split_transcript(text)
+    requests = []
+    for batch in batch_questions(q_and_a_arr):
+        chunk_ids = sorted({item.get('chunk', 0) for item in batch})
+        batch_text = '\n'.join(chunks[i] for i in chunk_ids if i < len(chunks)) or text
+        requests.append((strip_chunk(batch), batch_text))
+    return grade_batches(grade, requests)
+
+
+def grade_batches(grade, requests):
+    with FanOut(MAX_PARALLEL_REQUESTS) as executor:
+        futures = [executor.submit(grade, batch, batch_text) for batch, batch_text in requests]
+        results = []
+        for future in futures:
+            results += future.result()
+    return results
+
+
+def extract_and_grade(text, jd, api_key, graders, window_chars=PIPELINE_WINDOW_CHARS):
+    # graders maps a name to grade(batch, batch_text). Each chunk's new questions are sent to
+    # every grader as soon as that chunk is extracted, while the other chunks are still being
+    # extracted, so the critical path is about one extraction plus one grading of a chunk
+    # instead of the whole extraction followed by the whole grading.
+    chunks = split_transcript(text, window_chars)
+    print(f'Pipelined analysis: extracting and grading {len(chunks)} chunks')
+    merger = QuestionMerger()
+    graded = {name: [] for name in graders}
+    # separate pools, so gradings never queue behind the remaining extractions
+    with FanOut(min(len(chunks), MAX_PARALLEL_EXTRACTIONS)) as extract_pool, FanOut(MAX_PARALLEL_REQUESTS) as grade_pool:
+        extractions = {
+            extract_pool.submit(get_chunk_questions, chunk, jd, api_key, i + 1, len(chunks)): i
+            for i, chunk in enumerate(chunks)
+        }
+        gradings = []
+        for future in as_completed(extractions):
+            chunk_index = extractions[future]
+            for batch in batch_questions(merger.add(chunk_index, future.result())):
+                for name, grade in graders.items():
+                    gradings.append((name, grade_pool.submit(grade, strip_chunk(batch), chunks[chunk_index])))
+        for name, future in gradings:
+            graded[name] += future.result()
+    q_and_a_arr = merger.merged()
+    if not q_and_a_arr:
+        raise ValueError('q_and_a_arr is empty')
+    # results are joined back to the questions by question text, not by completion order
+    return q_and_a_arr, {name: align_items(q_and_a_arr, items) for name, items in graded.items()}
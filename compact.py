@@ -0,0 +1,109 @@
+import json
+import os
+import re
+
+import metrics
+
+# set COMPACT_PROMPTS=0 to send prompts, transcripts and Q&A arrays exactly as built
+COMPACT_PROMPTS = os.environ.get('COMPACT_PROMPTS', '1') != '0'
+# spoken disfluencies that carry no content; "uh-huh", "mm-hmm" and "yeah" are answers, so they stay
+FILLER_PATTERN = re.compile(r",?[ \t]*(?<![\w'-])(?:u+m+|u+h+m*|e+r+m+|h+m+)(?![\w'-]),?", re.IGNORECASE)
+# punctuation a removed filler left at the start of a turn, after its speaker label if it has one
+LABEL_PUNCTUATION = re.compile(r"^([\w .'-]{1,40}:)?[ \t]*[,.?!]+")
+# an answer is only replaced by a reference when most of its words are found in the passage
+MIN_ANSWER_COVERAGE = 0.6
+MIN_ANSWER_WORDS = 4
+
+
+def compact_enabled():
+    return COMPACT_PROMPTS
+
+
+def split_turns(text):
+    # speaker-labelled and paragraph transcripts have one turn per line; plain
+    # transcript.text is a single line, so fall back to sentences
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        return lines
+    return [s for s in re.split(r'(?<=[.?!])\s+', text.strip()) if s]
+
+
+def clean_transcript(text):
+    # drops filler words and blank lines and collapses runs of whitespace; line breaks between
+    # turns are kept, so cleaning an already clean transcript changes nothing
+    lines = []
+    for line in FILLER_PATTERN.sub('', text or '').splitlines():
+        line = re.sub(r' ([,.?!])', r'\1', re.sub(r'[ \t]+', ' ', line))
+        # punctuation left behind by a removed filler, e.g. "And uh. Hmm." -> "And.."
+        line = re.sub(r'([,.?!])[.,]+', r'\1', line)
+        # and at the start of a turn, e.g. "Speaker B: Hmm. Yes." -> "Speaker B:. Yes."
+        line = LABEL_PUNCTUATION.sub(lambda match: match.group(1) or '', line).strip()
+        if line and line not in ',.':
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def compact_prompt(prompt):
+    # the prompts are indented f-strings; the indentation is pure input tokens
+    lines = [line.strip() for line in (prompt or '').strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+def word_set(text):
+    return set(re.findall(r"[a-z0-9']+", text.lower()))
+
+
+def locate_answer(answer, turn_words):
+    # (first, last) turn of the passage holding the answer, or None if it cannot be found
+    wanted = word_set(answer)
+    if len(wanted) < MIN_ANSWER_WORDS or not turn_words:
+        return None
+    best = max(range(len(turn_words)), key=lambda i: len(wanted & turn_words[i]))
+    first = last = best
+    covered = wanted & turn_words[best]
+    # grow the passage while a neighbouring turn adds a noticeable part of the answer
+    while True:
+        gains = []
+        if last + 1 < len(turn_words):
+            gains.append((len(wanted & (covered | turn_words[last + 1])), last + 1))
+        if first > 0:
+            gains.append((len(wanted & (covered | turn_words[first - 1])), first - 1))
+        gain, turn = max(gains, default=(0, None))
+        if turn is None or gain - len(covered) < 0.1 * len(wanted):
+            break
+        covered = wanted & (covered | turn_words[turn])
+        first, last = min(first, turn), max(last, turn)
+    if len(covered) < MIN_ANSWER_COVERAGE * len(wanted):
+        return None
+    return first, last
+
+
+def encode_grading_input(q_and_a_arr, transcript_text):
+    # (Q&A JSON, transcript) for a grading prompt. Answers found in the transcript are sent as
+    # a reference to a tagged passage instead of a second verbatim copy; answers that cannot be
+    # located are kept as they are.
+    raw_json = json.dumps(q_and_a_arr)
+    if not transcript_text or not compact_enabled():
+        return raw_json, transcript_text
+    turns = split_turns(clean_transcript(transcript_text))
+    turn_words = [word_set(turn) for turn in turns]
+    opens, closes, taken = {}, {}, set()
+    pairs = []
+    for pair in q_and_a_arr:
+        reference = f"[transcript <{pair.get('id')}>]"
+        tags = len(f"<{pair.get('id')}></{pair.get('id')}>")
+        span = None
+        # only worth it when the answer is longer than the reference plus the two tags
+        if pair.get('id') and len(pair.get('answer', '')) > len(reference) + tags:
+            span = locate_answer(pair['answer'], turn_words)
+        if span is not None and not taken.intersection(range(span[0], span[1] + 1)):
+            taken.update(range(span[0], span[1] + 1))
+            opens[span[0]] = f"<{pair['id']}>"
+            closes[span[1]] = f"</{pair['id']}>"
+            pair = dict(pair, answer=reference)
+        pairs.append(pair)
+    text = '\n'.join(opens.get(i, '') + turn + closes.get(i, '') for i, turn in enumerate(turns))
+    encoded = json.dumps(pairs)
+    metrics.note_saved(len(raw_json) + len(transcript_text) - len(encoded) - len(text))
+    return encoded, text
+
@@ -0,0 +1,277 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SKILLS = ['Communication', 'Problem Solving', 'Python', 'System Design', 'Teamwork']
+SUMMARY = 'The candidate is a backend engineer with five years of Python experience who wants to join a small, data-focused team.'
+QUESTIONS = [
+    ('Can you tell me about yourself?', 'I have spent five years as a backend engineer working mostly in Python.'),
+    ('Why are you interested in this role?', 'I want to work on data-heavy products with a small team.'),
+    ('How would you design a rate limiter?', 'I would use a token bucket per client and keep the counters in Redis.'),
+    ('Tell me about a time you disagreed with a teammate.', 'We disagreed on a schema change, so we wrote both options up and picked one together.'),
+    ('How do you debug a slow API endpoint?', 'I start from traces, find the slowest span and then profile that code path.'),
+    ('What questions do you have for us?', 'How does the team decide what to work on each quarter?'),
+]
+
+
+def parse_latency(spec):
+    # fixed:0.5 | uniform:0.2,1.0 | normal:1.0,0.2 | lognormal:0.0,0.5 (seconds)
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    if kind == 'fixed':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def synthetic_questions(num_questions):
+    # longer interviews than the canned list get numbered questions so every pair is distinct
+    pairs = []
+    for i in range(num_questions):
+        question, answer = QUESTIONS[i % len(QUESTIONS)]
+        if num_questions > len(QUESTIONS):
+            question = f'Question {i + 1}: {question}'
+        pairs.append((question, answer))
+    return pairs
+
+
+def synthetic_interview(num_questions):
+    utterances = []
+    start = 0
+    for question, answer in synthetic_questions(num_questions):
+        for speaker, text in (('A', question), ('B', answer)):
+            end = start + 1000 * len(text.split()) // 3
+            utterances.append({'speaker': speaker, 'text': text, 'start': start, 'end': end, 'confidence': 0.95, 'words': []})
+            start = end + 500
+    text = ' '.join(u['text'] for u in utterances)
+    return text, utterances
+
+
+def first_json_array(text):
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'\[\s*\{', text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+            return value
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+class FakeAssemblyAI:
+    def __init__(self, lemur_latency='uniform:0.05,0.2', transcribe_latency='fixed:1.0', rate_limit_prob=0.0,
+                 retry_after=1, max_concurrent=0, num_questions=6, canned=None, seed=None, token_latency=0.0):
+        self.lemur_latency = parse_latency(lemur_latency)
+        self.transcribe_latency = parse_latency(transcribe_latency)
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after = retry_after
+        self.max_concurrent = max_concurrent
+        self.num_questions = num_questions
+        self.canned = canned or {}
+        # seconds per output token on top of lemur_latency, so longer answers take longer like the real API
+        self.token_latency = token_latency
+        self.rng = random.Random(seed)
+        self.transcripts = {}
+        self.in_flight = 0
+        self.request_counts = {}
+        self.lock = threading.Lock()
+
+    def count(self, key):
+        with self.lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def sample(self, distribution):
+        with self.lock:
+            return distribution(self.rng)
+
+    def should_rate_limit(self):
+        with self.lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                return True
+            return self.rng.random() < self.rate_limit_prob
+
+    # transcripts
+
+    def create_transcript(self, audio_url):
+        transcript_id = str(uuid.uuid4())
+        with self.lock:
+            self.transcripts[transcript_id] = {
+                'audio_url': audio_url,
+                'ready_at': time.monotonic() + self.transcribe_latency(self.rng),
+            }
+        return self.transcript_json(transcript_id)
+
+    def transcript_json(self, transcript_id):
+        with self.lock:
+            # unknown ids (e.g. from a manifest) are treated as finished transcripts
+            record = self.transcripts.setdefault(transcript_id, {'audio_url': 'https://example.com/audio.mp3', 'ready_at': 0})
+        if time.monotonic() < record['ready_at']:
+            return {'id': transcript_id, 'status': 'processing', 'audio_url': record['audio_url']}
+        text, utterances = synthetic_interview(self.num_questions)
+        text = self.canned.get('transcript', text)
+        return {
+            'id': transcript_id, 'status': 'completed', 'audio_url': record['audio_url'],
+            'text': text, 'utterances': utterances, 'words': [], 'audio_duration': utterances[-1]['end'] // 1000,
+        }
+
+    # LeMUR
+
+    def task_response(self, prompt, input_text=None):
+        for rule in self.canned.get('task', []):
+            if rule['match'] in prompt:
+                return rule['response']
+        q_and_a_arr = first_json_array(prompt) or []
+        if '"summary_paragraph"' in prompt:
+            # batched summaries: one object per <interview key="..."> in the input
+            questions = re.findall(r'^\s*Q\d+: (.+)$', prompt, re.MULTILINE)
+            summary = self.canned.get('summary', SUMMARY)
+            items = [{'key': key, 'summary_paragraph': summary, 'summary_topics': f'**Background**\n{summary}',
+                      'question_answer': [{'question': q, 'answer': self.canned.get('question_answer', {}).get(q, 'Unknown')}
+                                          for q in questions]}
+                     for key in re.findall(r'<interview key="(\w+)">', input_text or '')]
+        elif '"candidate_grade"' in prompt:
+            items = [{'id': q.get('id'), 'question': q.get('question', ''), 'answer': q.get('answer', ''), 'skill': self.rng.choice(SKILLS),
+                      'candidate_grade': self.rng.randint(1, 5), 'interviewer_grade': self.rng.randint(1, 5)} for q in q_and_a_arr]
+        elif '"skill":"<skill>"' in prompt:
+            items = [{'id': q.get('id'), 'question': q.get('question', ''), 'answer': q.get('answer', ''), 'skill': self.rng.choice(SKILLS)} for q in q_and_a_arr]
+        elif '"grade":"<grade>"' in prompt:
+            items = [{'id': q.get('id'), 'question': q.get('question', ''), 'answer': q.get('answer', ''), 'grade': str(self.rng.randint(1, 5))} for q in q_and_a_arr]
+        else:
+            pairs = synthetic_questions(self.num_questions)
+            if input_text and any(q in input_text or a in input_text for q, a in pairs):
+                # a chunk of the synthetic transcript only contains some of the questions
+                pairs = [(q, a) for q, a in pairs if q in input_text]
+            items = [{'question': q, 'answer': a} for q, a in pairs]
+        return 'Here is the data you asked for:\n' + json.dumps(items, indent=2)
+
+    def lemur(self, endpoint, body):
+        prompt = body.get('prompt') or body.get('context') or ''
+        if endpoint == 'task':
+            response = self.task_response(prompt, body.get('input_text'))
+        elif endpoint == 'summary':
+            response = self.canned.get('summary', SUMMARY)
+        else:
+            response = [
+                {'question': q['question'], 'answer': self.canned.get('question_answer', {}).get(q['question'], 'Unknown')}
+                for q in body.get('questions', [])
+            ]
+        input_size = len(json.dumps(body))
+        return {
+            'request_id': str(uuid.uuid4()),
+            'response': response,
+            'usage': {'input_tokens': input_size // 4, 'output_tokens': len(json.dumps(response)) // 4},
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('content-length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def rate_limited(self):
+        self.send_json(429, {'error': 'Too Many Requests'}, {'retry-after': str(self.fake.retry_after)})
+
+    def do_GET(self):
+        match = re.fullmatch(r'/v2/transcript/([\w-]+)', self.path)
+        if not match:
+            return self.send_json(404, {'error': f'Not found: {self.path}'})
+        self.fake.count('get_transcript')
+        if self.fake.should_rate_limit():
+            return self.rate_limited()
+        self.send_json(200, self.fake.transcript_json(match.group(1)))
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == '/v2/upload':
+            self.fake.count('upload')
+            return self.send_json(200, {'upload_url': f'https://fake-cdn.local/{uuid.uuid4()}'})
+        if self.path == '/v2/transcript':
+            self.fake.count('transcript')
+            if self.fake.should_rate_limit():
+                return self.rate_limited()
+            return self.send_json(200, self.fake.create_transcript(json.loads(body)['audio_url']))
+
+        match = re.fullmatch(r'/lemur/v3/generate/(task|summary|question-answer)', self.path)
+        if not match:
+            return self.send_json(404, {'error': f'Not found: {self.path}'})
+        endpoint = match.group(1)
+        self.fake.count(endpoint)
+        if self.fake.should_rate_limit():
+            return self.rate_limited()
+        with self.fake.lock:
+            self.fake.in_flight += 1
+        try:
+            payload = self.fake.lemur(endpoint, json.loads(body))
+            time.sleep(self.fake.sample(self.fake.lemur_latency) + self.fake.token_latency * payload['usage']['output_tokens'])
+            self.send_json(200, payload)
+        finally:
+            with self.fake.lock:
+                self.fake.in_flight -= 1
+
+
+def start_server(host='127.0.0.1', port=0, **config):
+    # runs in a background thread; returns (server, base_url, fake) so callers can inspect counters
+    fake = FakeAssemblyAI(**config)
+    handler = type('FakeHandler', (Handler,), {'fake': fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}', fake
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the AssemblyAI transcription and LeMUR endpoints.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--lemur-latency', default='uniform:0.05,0.2', help='fixed:S | uniform:A,B | normal:MEAN,SD | lognormal:MU,SIGMA')
+    parser.add_argument('--transcribe-latency', default='fixed:1.0', help='time until a submitted transcript completes')
+    parser.add_argument('--rate-limit-prob', type=float, default=0.0, help='probability of answering any request with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--max-concurrent', type=int, default=0, help='answer 429 when more LeMUR requests than this are in flight')
+    parser.add_argument('--questions', type=int, default=6, help='number of Q&A pairs in synthetic transcripts')
+    parser.add_argument('--canned', help='JSON file with canned "transcript", "summary", "question_answer" and "task" [{match, response}] entries')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--token-latency', type=float, default=0.0, help='extra seconds per LeMUR output token')
+    args = parser.parse_args(argv)
+
+    canned = None
+    if args.canned:
+        with open(args.canned) as f:
+            canned = json.load(f)
+    fake = FakeAssemblyAI(args.lemur_latency, args.transcribe_latency, args.rate_limit_prob, args.retry_after,
+                          args.max_concurrent, args.questions, canned, args.seed, args.token_latency)
+    handler = type('FakeHandler', (Handler,), {'fake': fake})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f'Fake AssemblyAI listening on http://{args.host}:{args.port}')
+    print(f'Run the app with ASSEMBLYAI_BASE_URL=http://{args.host}:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# run_stages runs each stage call under one slot of its request semaphore. A stage that fans its
+# LeMUR requests out (chunks, grading batches, the gradings of a pipelined stage) gives that slot
+# back and each request takes one of its own, so the semaphore bounds requests in flight however
+# the stages split them. Outside run_stages there is no slot and only the pool size bounds them.
+current_slot = contextvars.ContextVar('current_slot', default=None)
+
+
+class RequestSlot:
+    # taken and held by a worker thread, never while waiting for one: a stage waiting on its
+    # fanned-out requests holds a thread of the shared pool, so a slot held by a call still queued
+    # for a thread could be the one those requests need
+    def __init__(self, loop, semaphore):
+        self.loop = loop
+        self.semaphore = semaphore
+        self.held = False
+
+    def call(self, fn, *args):
+        asyncio.run_coroutine_threadsafe(self.semaphore.acquire(), self.loop).result()
+        self.held = True
+        current_slot.set(self)
+        try:
+            return fn(*args)
+        finally:
+            self.release()
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.loop.call_soon_threadsafe(self.semaphore.release)
+
+
+class FanOut:
+    # a ThreadPoolExecutor for the requests of the current stage call, each under a slot of the
+    # stage's semaphore; the threads are its own, since they wait for slots
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slot = current_slot.get()
+        if self._slot is not None:
+            self._slot.release()
+
+    def submit(self, fn, *args):
+        if self._slot is None:
+            return self._executor.submit(fn, *args)
+        slot = RequestSlot(self._slot.loop, self._slot.semaphore)
+        return self._executor.submit(contextvars.copy_context().run, slot.call, fn, *args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,189 @@
+import json
+import os
+import secrets
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import assemblyai as aai
+
+from analysis import submit_transcription, transcription_config
+from backend import get_backend
+import metrics
+
+UPLOAD_WORKERS = int(os.environ.get('TRANSCRIBE_UPLOAD_WORKERS', 4))
+POLL_INTERVAL = float(os.environ.get('TRANSCRIBE_POLL_INTERVAL', 3))
+# with a webhook the poller is only a safety net for lost deliveries
+WEBHOOK_POLL_INTERVAL = 30
+# public URL that reaches the listener below, e.g. https://example.com:8766/
+WEBHOOK_URL = os.environ.get('TRANSCRIBE_WEBHOOK_URL', '')
+WEBHOOK_PORT = int(os.environ.get('TRANSCRIBE_WEBHOOK_PORT', 8766))
+WEBHOOK_HEADER = 'X-Transcript-Webhook-Token'
+# finished jobs are forgotten after this long
+JOB_TTL = 60 * 60
+
+
+class TranscriptionJob:
+    def __init__(self, source, api_key=None, name=None):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.api_key = api_key
+        self.name = name or (source if isinstance(source, str) else getattr(source, 'name', 'upload'))
+        self.status = 'queued'
+        self.transcript_id = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # resolves to the transcript id, or raises if the upload or transcription failed
+        self.future = Future()
+
+    def done(self):
+        return self.future.done()
+
+
+class TranscriptionQueue:
+    # Uploads and submissions run on a small worker pool and return straight away. A single
+    # poller thread then checks every pending transcript once per interval, so waiting on N
+    # transcripts takes one thread instead of N blocked ones. With a webhook configured,
+    # AssemblyAI reports completion itself and polling slows down to a fallback.
+    def __init__(self, workers=UPLOAD_WORKERS, poll_interval=POLL_INTERVAL, webhook_url=WEBHOOK_URL):
+        self.webhook_url = webhook_url
+        self.poll_interval = max(poll_interval, WEBHOOK_POLL_INTERVAL) if webhook_url else poll_interval
+        self.webhook_token = secrets.token_urlsafe(16)
+        self.jobs = {}
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def submit(self, source, api_key=None, name=None):
+        # source is a URL, a local path or an open binary file; files are streamed to the
+        # upload endpoint from where they are, never copied to a shared temp path
+        job = TranscriptionJob(source, api_key, name)
+        with self._lock:
+            self._prune()
+            self.jobs[job.id] = job
+        self._executor.submit(self._start, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def config(self):
+        if not self.webhook_url:
+            return transcription_config()
+        return transcription_config(webhook_url=self.webhook_url, webhook_auth_header_name=WEBHOOK_HEADER,
+                                       webhook_auth_header_value=self.webhook_token)
+
+    def _start(self, job):
+        job.status = 'submitting' if isinstance(job.source, str) and job.source.startswith('http') else 'uploading'
+        try:
+            job.transcript_id = submit_transcription(job.source, job.api_key, self.config())
+        except Exception as e:
+            print(f'Submitting {job.name} failed: {e}')
+            self._finish(job, e)
+            return
+        job.status = 'processing'
+        with self._lock:
+            self._pending[job.transcript_id] = job
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._pending:
+                    self._poller = None
+                    return
+                pending = list(self._pending.values())
+            for job in pending:
+                try:
+                    transcript = get_backend().transcript_status(job.transcript_id, job.api_key)
+                except Exception as e:
+                    print(f'Polling transcript {job.transcript_id} failed: {e}')
+                    continue
+                self.update(job.transcript_id, transcript.status, transcript.error)
+
+    def update(self, transcript_id, status, error=None):
+        # called by the poller and by the webhook listener; statuses other than
+        # completed/error leave the job pending
+        if status not in (aai.TranscriptStatus.completed, aai.TranscriptStatus.error):
+            return
+        with self._lock:
+            job = self._pending.pop(transcript_id, None)
+        if job is None:
+            return
+        if status == aai.TranscriptStatus.completed:
+            print(f'File {job.name} Transcript Id: {transcript_id}')
+            self._finish(job)
+        else:
+            self._finish(job, RuntimeError(f'Transcription of {job.name} failed: {error or "unknown error"}'))
+
+    def _finish(self, job, error=None):
+        job.finished_at = time.time()
+        metrics.record_duration('transcribe_file', job.finished_at - job.created_at, ok=error is None)
+        # the file object is not needed anymore; let it be freed with the session
+        job.source = job.name
+        if error is None:
+            job.status = 'completed'
+            job.future.set_result(job.transcript_id)
+        else:
+            job.status = 'error'
+            job.error = str(error)
+            job.future.set_exception(error)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [i for i, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    queue = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get(WEBHOOK_HEADER) != self.queue.webhook_token:
+            self.send_response(401)
+        else:
+            try:
+                payload = json.loads(body)
+                self.queue.update(payload['transcript_id'], payload['status'])
+                self.send_response(200)
+            except (ValueError, KeyError):
+                self.send_response(400)
+        self.send_header('content-length', '0')
+        self.end_headers()
+
+
+def start_webhook_listener(queue, host='0.0.0.0', port=WEBHOOK_PORT):
+    handler = type('QueueWebhookHandler', (WebhookHandler,), {'queue': queue})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Listening for transcript webhooks on {host}:{server.server_address[1]}')
+    return server
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = TranscriptionQueue()
+                if _queue.webhook_url:
+                    start_webhook_listener(_queue)
+    return _queue
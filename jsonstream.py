@@ -0,0 +1,98 @@
+import json
+import re
+
+
+def valid_item(item, schema=None):
+    # schema maps each required key to a type or to a predicate on the value
+    if not isinstance(item, dict):
+        return False
+    for key, check in (schema or {}).items():
+        if key not in item:
+            return False
+        if isinstance(check, type):
+            if not isinstance(item[key], check):
+                return False
+        elif not check(item[key]):
+            return False
+    return True
+
+
+def closing_brace(text, start):
+    # index of the brace that closes the object opening at start, or -1 if the text ends first
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+class JsonArrayStream:
+    # Recovers the objects of a JSON array from a noisy or partial LeMUR response. Text can
+    # be fed in pieces; feed() returns each object as soon as its closing brace arrives.
+    # Prose around the array, braces and brackets inside that prose and malformed elements are
+    # skipped one object at a time instead of discarding the whole response.
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.buffer = ''
+        self.pos = 0
+        self.rejected = 0
+        self._decoder = json.JSONDecoder(strict=False)
+
+    def feed(self, text):
+        self.buffer += text
+        items = []
+        while True:
+            start = self.buffer.find('{', self.pos)
+            if start == -1:
+                self.pos = len(self.buffer)
+                return items
+            value, end = self.decode_at(start)
+            if end is None:
+                # wait for the rest of the object
+                self.pos = start
+                return items
+            self.pos = end
+            if valid_item(value, self.schema):
+                items.append(value)
+            else:
+                self.rejected += 1
+
+    def decode_at(self, start):
+        # (object, index after it) for the object opening at start; (None, start + 1) when it is
+        # malformed, so the search goes on from the next brace instead of the whole rest of the
+        # text hanging on one unbalanced brace; (None, None) while it may still be arriving
+        try:
+            return self._decoder.raw_decode(self.buffer, start)
+        except json.JSONDecodeError:
+            pass
+        end = closing_brace(self.buffer, start)
+        if end == -1:
+            if self.buffer.find('{', start + 1) == -1:
+                return None, None
+            return None, start + 1
+        # the usual model mistake is a trailing comma before a closing brace
+        try:
+            return self._decoder.decode(re.sub(r',\s*}', '}', self.buffer[start:end + 1])), end + 1
+        except json.JSONDecodeError:
+            return None, start + 1
+
+    @property
+    def truncated(self):
+        # an object was opened but the response ended before it was closed
+        return self.buffer.find('{', self.pos) != -1
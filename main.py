@@ -1,492 +1,218 @@
-from retrying import retry, RetryError
-from time import sleep
-from concurrent.futures import ThreadPoolExecutor
-import st_btn_select
-from pathlib import Path
-import streamlit_scrollable_textbox as stx
-import assemblyai as aai
+import time
+# taken before the imports, so the first run in a fresh process includes loading them
+script_started = time.perf_counter()
 import os
 import streamlit as st
-import json
-import re
-
-def transcribe_file(file):
-    print('starting transcribe')
-    transcript = aai.Transcriber().transcribe(file)
-    print(f'File {file} Transcript Id: {transcript.id}')
-    return transcript.id
-
-def filter_q_and_a(q_and_a_arr):
-    filtered_arr = []
-    for item in q_and_a_arr:
-        if "question" in item and "answer" in item:
-            filtered_arr.append(item)
-    return filtered_arr
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def get_questions(transcript_id, jd, api_key, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            prompt = f'''
-                You are reading transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Please pull out questions asked by interviewer and responses of the candidate. 
-                Format the questions as if they were appearing on a test.
-
-                Return data in following JSON format: [{{"question":"<question>","answer":"<answer>"}}].
-            '''
-            result = aai.Lemur().task(
-                prompt=prompt,
-                input_text=transcript_text,  # Pass transcript_text to Lemur
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            prompt = f'''
-                You are reading transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Please pull out questions asked by interviewer and responses of the candidate. 
-                Format the questions as if they were appearing on a test.
-
-                Return data in following JSON format: [{{"question":"<question>","answer":"<answer>"}}].
-            '''
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id]) 
-            result = transcript_group.lemur.task(
-                prompt=prompt,
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        print(result.response)
-        q_and_a_arr = filter_q_and_a(parse_json(result.response))
-
-        if not q_and_a_arr:
-            print("q_and_a_arr is empty")
-            raise ValueError("q_and_a_arr is empty")
-        return q_and_a_arr
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty array.")
-        return []
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def get_skills(transcript_id, jd, skills, api_key, q_and_a_arr, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            new_prompt = f'''
-                You are reading transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Here is an array of the questions asked by the interviewer and the candidates answer in the transcript: {json.dumps(q_and_a_arr)}
-                Reference the transcript for a more complete understanding of the candidates answer.
-
-                Tag each question and answer pair as relating to one of following skills:{skills}
-
-                Return data in following JSON format: [{{"question":"<question>","answer":"<answer>", "skill":"<skill>"}}].
-            '''
-            result = aai.Lemur().task(
-                prompt=new_prompt,
-                input_text=transcript_text,  # Pass transcript_text to Lemur
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            new_prompt = f'''
-                You are reading transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Here is an array of the questions asked by the interviewer and the candidates answer in the transcript: {json.dumps(q_and_a_arr)}
-                Reference the transcript for a more complete understanding of the candidates answer.
-
-                Tag each question and answer pair as relating to one of following skills:{skills}
-
-                Return data in following JSON format: [{{"question":"<question>","answer":"<answer>", "skill":"<skill>"}}].
-            '''
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id]) 
-            result = transcript_group.lemur.task(
-                prompt=new_prompt,
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        print(result.response)
-        final_q_and_a_arr = parse_json(result.response)
-        if not final_q_and_a_arr:
-            print("final_q_and_a_arr is empty")
-            raise ValueError("final_q_and_a_arr is empty")
-        return final_q_and_a_arr
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty array.")
-        return []
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def candidate_quality_assessment(transcript_id, jd, skills, api_key, q_and_a_arr, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            prompt = f'''
-                You are reading transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Here is an array of objects that each include a question asked by the interviewer, the candidates answer to the question, and the related skill: {json.dumps(q_and_a_arr)}
-                For each question, reference the transcript for a more complete understanding of the candidates answer.
-
-                As a candidate assessor, please grade candidates answers to questions with an integer grade based on rubric below:
-                Rubric:
-                5: Excellent
-                4: Good
-                3: Mediocre
-                2: Bad
-                1: Terrible
-
-                Return data in following JSON format: [{{"question":"<question>","answer":"<answer>", "grade":"<grade>"}}].
-            '''
-            result = aai.Lemur().task(
-                prompt=prompt,
-                input_text=transcript_text,  # Pass transcript_text to Lemur
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            prompt = f'''
-                You are reading transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Here is an array of objects that each include a question asked by the interviewer, the candidates answer to the question, and the related skill: {json.dumps(q_and_a_arr)}
-                For each question, reference the transcript for a more complete understanding of the candidates answer.
-
-                As a candidate assessor, please grade candidates answers to questions with an integer grade based on rubric below:
-                Rubric:
-                5: Excellent
-                4: Good
-                3: Mediocre
-                2: Bad
-                1: Terrible
-
-                Return data in following JSON format: [{{"question":"<question>","answer":"<answer>", "grade":"<grade>"}}].
-            '''
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id]) 
-            result = transcript_group.lemur.task(
-                prompt=prompt,
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        return parse_json(result.response)
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty array.")
-        return []
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def interviewer_quality_assessment(transcript_id, jd, skills, api_key, q_and_a_arr, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            prompt = f'''
-                You are reading a transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Here is an array of objects that each include a question asked by the interviewer, the candidates answer to the question, and the related skill: {json.dumps(q_and_a_arr)}
-                Reference the transcript for a more complete understanding of the candidates answer.
-
-                As an interviewer assessor, your role involves evaluating the relevance of each question posed by the interviewer. 
-                Avoid assigning low grades unless the questions lack relevance to the job description. 
-                Questions pertaining to soft skills and background, such as "tell me about yourself" and "how do you work in teams," should be considered essential.
-                
-                Please grade the interviewers questions with an integer grade based on the rubric below:
-                Rubric:
-                5: Very Necessary
-                4: Critical
-                3: Optional
-                2: Unneccessary
-                1: Completely Irrelevant
-
-                Return the data in the following JSON format: [{{"question":"<question>", "grade":"<grade>"}}].
-            '''
-            result = aai.Lemur().task(
-                prompt=prompt,
-                input_text=transcript_text,  # Pass transcript_text to Lemur
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            prompt = f'''
-                You are reading a transcript of a job interview.
-
-                Here is the job description for that interview: <jd>{jd}</jd>
-
-                Here is an array of objects that each include a question asked by the interviewer, the candidates answer to the question, and the related skill: {json.dumps(q_and_a_arr)}
-                Reference the transcript for a more complete understanding of the candidates answer.
-
-                As an interviewer assessor, your role involves evaluating the relevance of each question posed by the interviewer. 
-                Avoid assigning low grades unless the questions lack relevance to the job description. 
-                Questions pertaining to soft skills and background, such as "tell me about yourself" and "how do you work in teams," should be considered essential.
-                
-                Please grade the interviewers questions with an integer grade based on the rubric below:
-                Rubric:
-                5: Very Necessary
-                4: Critical
-                3: Optional
-                2: Unneccessary
-                1: Completely Irrelevant
-
-                Return the data in the following JSON format: [{{"question":"<question>", "grade":"<grade>"}}].
-            '''
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id])  
-            result = transcript_group.lemur.task(
-                prompt=prompt,
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        return parse_json(result.response)
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty array.")
-        return []
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def generate_summary_paragraph(transcript_id, api_key, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            result = aai.Lemur().summarize(
-                context="you are the interviewer on this meeting. your job is to write a fact-based candidate summary for the hiring manager to review. do not include any opinions or details that are not directly from the interview. Focus the summary on the candidate background and motiviations for the role",
-                answer_format="paragraph",
-                input_text=transcript_text,  # Pass transcript_text to summarize
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id])  
-            result = transcript_group.lemur.summarize(
-                context="you are the interviewer on this meeting. your job is to write a fact-based candidate summary for the hiring manager to review. do not include any opinions or details that are not directly from the interview. Focus the summary on the candidate background and motiviations for the role",
-                answer_format="paragraph",
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        return result.response
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty string.")
-        return ''
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def generate_summary_topics(transcript_id, api_key, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            result = aai.Lemur().summarize(
-                context="you are the interviewer on this meeting. your job is to write a fact-based candidate summary for the hiring manager to review. do not include any opinions or details that are not directly from the interview. Focus the summary on the candidate background and motiviations for the role",
-                answer_format="**<topic header>**\n<topic summary>\n",
-                input_text=transcript_text,  # Pass transcript_text to summarize
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id])  
-            result = transcript_group.lemur.summarize(
-                context="you are the interviewer on this meeting. your job is to write a fact-based candidate summary for the hiring manager to review. do not include any opinions or details that are not directly from the interview. Focus the summary on the candidate background and motiviations for the role",
-                answer_format="**<topic header>**\n<topic summary>\n",
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        return result.response
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty string.")
-        return ''
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def generate_summary_questions(transcript_id, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            result = aai.Lemur().summarize(
-                context="list the questions the interviewer asked the candidate. for each interview question, list the candidate response in bullet points",
-                answer_format="<Interview Question>,• <Candidate Response>",
-                input_text=transcript_text,  # Pass transcript_text to summarize
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        else:  # Use Lemur with transcript ID
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id])  
-            result = transcript_group.lemur.summarize(
-                context="list the questions the interviewer asked the candidate. for each interview question, list the candidate response in bullet points",
-                answer_format="<Interview Question>,• <Candidate Response>",
-                max_output_size=4000,
-                final_model='anthropic/claude-3-5-sonnet'
-            )
-        return result.response
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty string.")
-        return ''
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-@retry(wait_fixed=1000, stop_max_attempt_number=10)
-def generate_question_answer(transcript_id, api_key, transcript_text=None):  # Add transcript_text parameter
-    try:
-        if transcript_text:  # Use Lemur with input text
-            # ask some questions
-            questions = [
-                aai.LemurQuestion(question="what role is the candidate interviewing for?"),
-                aai.LemurQuestion(question="what is the candidate's relevant skills or background?"),
-                aai.LemurQuestion(question="how many years of relevant experience does the candidate? provide context for your answer?",answer_options=["1-3","4-7","more than 7","Unknown"]),
-                aai.LemurQuestion(question="what are the candidate's strengths and weaknesses?"),
-                aai.LemurQuestion(question="what questions did the candidate ask the interviewer?",answer_format="bullet points"),
-            ]  
-            result = aai.Lemur().question(questions, input_text=transcript_text)  # Pass transcript_text to question
-        else:  # Use Lemur with transcript ID
-            aai.settings.api_key = api_key
-            transcript_group = aai.TranscriptGroup.get_by_ids([transcript_id])
-            # ask some questions
-            questions = [
-                aai.LemurQuestion(question="what role is the candidate interviewing for?"),
-                aai.LemurQuestion(question="what is the candidate's relevant skills or background?"),
-                aai.LemurQuestion(question="how many years of relevant experience does the candidate? provide context for your answer?",answer_options=["1-3","4-7","more than 7","Unknown"]),
-                aai.LemurQuestion(question="what are the candidate's strengths and weaknesses?"),
-                aai.LemurQuestion(question="what questions did the candidate ask the interviewer?",answer_format="bullet points"),
-            ]  
-            result = transcript_group.lemur.question(questions)
-        return result.response
-    except RetryError:
-        # Handle the case when all retries are used
-        print("All retries used. Returning empty list.")
-        return []
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        print("Re-running LeMUR Request")
-        try:
-            if '429' in e:
-                sleep(60)
-        except: pass
-        raise
-
-def parse_json(response_string):
-    # Remove newline characters
-    response_string = response_string.replace('\n', ' ')
-
-    start_index = response_string.find('[')
-    end_index = response_string.rfind(']') + 1
-    # Check if both '[' and ']' are present in the response_string
-    if start_index == -1 or end_index == 0:
-        return []  # Return an empty array if either '[' or ']' is not present
-    json_content = response_string[start_index:end_index]
-    try:
-        response_json = json.loads(json_content)
-        return response_json
-    except json.JSONDecodeError as e:
-        # # errors are irrelevant, moves on if not found
-        print(f"Error decoding JSON: {e}")
-        return [] 
-
-def calculateQualityScore(arr):
-    points = 0
-    total = 0
-    for n in arr:
-        try:
-            grade = int(n['grade'])
-            total += 5
-            points += grade
-        except:
-            pass  # If grade is not convertible to int, do nothing
-    if total == 0:
-        return 0  # Avoid division by zero
-    return points / total
-
-
-# Initialize session_state if it doesn't exist
-if 'api_key' not in st.session_state:
-    st.session_state.api_key = ''
-if 'homepage' not in st.session_state:
-    st.session_state.homepage = True
-if 'complete' not in st.session_state:
+import metrics
+from cache import get_cache, cache_enabled
+from matching import calculateQualityScore, match_items
+from store import get_store, job_title, question_answer_dicts
+
+# long transcripts and assessments are shown a page at a time, so a rerun does not send all of it again
+TRANSCRIPT_PAGE_CHARS = int(os.environ.get('TRANSCRIPT_PAGE_CHARS', 5000))
+QUESTIONS_PER_PAGE = int(os.environ.get('QUESTIONS_PER_PAGE', 10))
+
+SECTIONS = {
+    'summary_paragraph': 'Paragraph Summary',
+    'summary_topics': 'Topic Summary',
+    'question_answer': 'Basic Question-Answer',
+    'parsed_candidate_assessment': 'Candidate Assessment',
+    'parsed_interviewer_audit': 'Interviewer Assessment',
+}
+
+# Created once per process and shared by every session. The analysis engine (assemblyai, the
+# pipeline) is imported on first use, so the homepage loads without it.
+@st.cache_resource
+def analysis_server():
+    from server import get_server
+    return get_server()
+
+@st.cache_resource
+def transcription_queue():
+    from jobs import get_queue
+    return get_queue()
+
+@st.cache_resource
+def results_store():
+    return get_store()
+
+@st.cache_data(max_entries=4)
+def saved_tables(latest_id):
+    # the sidebar aggregates, computed again only once another interview has been saved
+    return results_store().skill_averages(), results_store().score_trend()
+
+@st.cache_data(max_entries=8)
+def transcript_pages(text, page_chars=TRANSCRIPT_PAGE_CHARS):
+    # whole lines, up to page_chars per page
+    pages, current, size = [], [], 0
+    for line in text.splitlines():
+        if current and size + len(line) > page_chars:
+            pages.append('\n'.join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pages.append('\n'.join(current))
+    return pages or ['']
+
+def page_of(items, key, per_page):
+    # the items on the page picked with a page number; there is no picker when everything fits
+    pages = max(1, -(-len(items) // per_page))
+    if pages == 1:
+        return items
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = 1
+    page = st.number_input(f'Page (of {pages})', min_value=1, max_value=pages, value=1, key=key)
+    return items[(page - 1) * per_page:page * per_page]
+
+def lookup_skills(items, skills, pending=False):
+    # skills are found by question id (or text), not position, since the skills stage may
+    # have dropped or reordered items; pending: the skills stage is still running
+    skills = skills or []
+    matches = match_items(items, skills, pair_leftovers=False)
+    result = []
+    for q, match in zip(items, matches):
+        if 'skill' in q:
+            result.append(q['skill'] or '')
+        elif match is not None:
+            result.append(skills[match].get('skill', ''))
+        else:
+            result.append('pending...' if pending else '')
+    return result
+
+def render_candidate_assessment(items, skills=None, page_key=None, skills_pending=False):
+    st.subheader('Candidate Assessment')
+    page = page_of(items, page_key, QUESTIONS_PER_PAGE) if page_key else items
+    for q, skill in zip(page, lookup_skills(page, skills, skills_pending)):
+        st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
+        st.write('Question: ' + q['question'])
+        st.write('Answer: ' + q['answer'])
+        st.write('Skill: ' + skill)
+        st.write('Grade: ' + str(q['grade']))
+    st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
+    st.write('Quality Score: '+str(calculateQualityScore(items)*100))
+    st.write('Quality score formula: (total points)/(5 * # of questions *)')
+
+def render_interviewer_assessment(items, skills=None, page_key=None, skills_pending=False):
+    st.subheader('Interviewer Assessment')
+    page = page_of(items, page_key, QUESTIONS_PER_PAGE) if page_key else items
+    for q, skill in zip(page, lookup_skills(page, skills, skills_pending)):
+        st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
+        st.write('Question: ' + q['question'])
+        st.write('Grade: ' + str(q['grade']))
+        st.write('Skill: ' + skill)
+    st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
+    st.write('Quality Score: '+str(calculateQualityScore(items)*100))
+    st.write('Quality score formula: (total points)/(5 * # of questions *)')
+
+def render_summary_paragraph(summary_paragraph):
+    st.subheader('Paragraph Summary')
+    st.write(summary_paragraph)
+
+def render_summary_topics(summary_topics):
+    st.subheader('Topic Summary')
+    st.write(summary_topics)
+
+def render_question_answer(question_answer):
+    st.subheader('Basic Question-Answer')
+    for q in question_answer_dicts(question_answer):
+        st.write(q['question'])
+        st.write(f"Answer: {q['answer']}")
+        st.write()
+
+def render_progress(stages, graded):
+    # sections of a running analysis as far as its stages have finished. The assessments grow
+    # batch by batch (a chunk's questions in pipelined or long-transcript analysis, all of them
+    # otherwise), since LeMUR answers a request at once rather than streaming it. Not paged, since
+    # the view is redrawn every second until the results page replaces it.
+    for name, title in SECTIONS.items():
+        items = stages.get(name, graded.get(name))
+        if items is None:
+            st.caption(f'{title}: in progress...')
+        elif name == 'parsed_candidate_assessment':
+            render_candidate_assessment(items, stages.get('skills'), skills_pending='skills' not in stages)
+        elif name == 'parsed_interviewer_audit':
+            render_interviewer_assessment(items, stages.get('skills'), skills_pending='skills' not in stages)
+        elif name == 'summary_paragraph':
+            render_summary_paragraph(stages[name])
+        elif name == 'summary_topics':
+            render_summary_topics(stages[name])
+        elif name == 'question_answer':
+            render_question_answer(stages[name])
+
+SESSION_DEFAULTS = {
+    'api_key': '',
+    'homepage': True,
+    'complete': False,
+    'transcript_id_input': '',
+    'transcription_job': None,
+    'analysis_job': None,
+    'result': None,
+    'previous_result': None,
+    'job_description': '',
+    'skills': '',
+    'transcript_text': '',
+    'fused': False,
+    'pipelined': False,
+    'candidate': '',
+    'interviewer': '',
+}
+
+# Initialize session_state on the first run of a session
+first_run = 'homepage' not in st.session_state
+if first_run:
+    for name, value in SESSION_DEFAULTS.items():
+        st.session_state[name] = value
+
+def show_result(result):
+    st.session_state.result = result
+    st.session_state.transcript_id = result['transcript_id']
+    st.session_state.transcript_text = result['transcript_text']
+    st.session_state.parsed_candidate_assessment = result['parsed_candidate_assessment']
+    st.session_state.parsed_interviewer_audit = result['parsed_interviewer_audit']
+    st.session_state.summary_paragraph = result['summary_paragraph']
+    st.session_state.summary_topics = result['summary_topics']
+    st.session_state.question_answer = result['question_answer']
+    if result.get('inputs'):
+        st.session_state.job_description = result['inputs']['jd']
+        st.session_state.skills = result['inputs']['skills']
+    st.session_state.complete = True
+
+def load_saved_interview(interview_id):
+    show_result(results_store().get(interview_id))
+    st.session_state.homepage = False
+
+def reanalyze():
+    # same transcript, edited inputs: the server re-runs only the stages that read them
+    job_description, skills = st.session_state.edit_job_description, st.session_state.edit_skills
+    st.session_state.previous_result = st.session_state.result
+    st.session_state.transcript_id_input = st.session_state.transcript_id
+    st.session_state.transcription_job = None
+    st.session_state.analysis_job = None
+    st.session_state.job_description = job_description
+    st.session_state.skills = skills
     st.session_state.complete = False
-if 'transcript_id_input' not in st.session_state:
-    st.session_state.transcript_id_input = ''
-if 'local_file' not in st.session_state:
-    st.session_state.local_file = None
-if 'url_input' not in st.session_state:
-    st.session_state.url_input = ''
-if 'job_description' not in st.session_state:
-    st.session_state.job_description = ''
-if 'skills' not in st.session_state:
-    st.session_state.skills = ''
-if 'transcript_text' not in st.session_state:
-    st.session_state.transcript_text = ''
+
+with st.sidebar:
+    # past results come from the results store, so they survive RESET and browser refreshes
+    saved = results_store().list_interviews(limit=50)
+    if saved:
+        st.subheader('Saved interviews')
+        labels = {f"#{row['id']} {row['candidate'] or 'Unnamed'} - {row['job'] or 'No job'} ({time.strftime('%Y-%m-%d', time.localtime(row['created_at']))})": row['id'] for row in saved}
+        label = st.selectbox('Interview', list(labels))
+        st.button('Open', on_click=load_saved_interview, args=(labels[label],))
+        skill_averages, score_trend = saved_tables(max(row['id'] for row in saved))
+        with st.expander('Average grade per skill'):
+            st.table(skill_averages)
+        with st.expander('Scores by month'):
+            st.table(score_trend)
 
 st.title('Interviewer Audit and Candidate Assessment')
 
 if st.session_state.homepage:
     # api key
     api_key = st.text_input('Enter your AssemblyAI API key: ', value=st.session_state.api_key, type='password')
-    aai.settings.api_key = api_key
+    # the key stays in this session and goes along with each job; it is never set globally
     st.session_state.api_key = api_key
 
     # File
@@ -500,6 +226,10 @@ if st.session_state.homepage:
     st.write('Enter job description and skills list')
     job_description = st.text_area('Enter your job description')
     skills = st.text_area('Enter the Skills List:')
+    candidate = st.text_input('Candidate name (optional, used to file the results)', value=st.session_state.candidate)
+    interviewer = st.text_input('Interviewer name (optional)', value=st.session_state.interviewer)
+    fused = st.checkbox('Fast grading (tag skills and grade candidate and interviewer in a single LeMUR request)', value=st.session_state.fused)
+    pipelined = st.checkbox('Pipelined analysis (grade each part of the transcript while the rest is still being read)', value=st.session_state.pipelined)
 
     button = st.button('Submit')
     if button:
@@ -508,34 +238,46 @@ if st.session_state.homepage:
         else:
             st.session_state.homepage = False
             st.session_state.transcript_id_input = transcript_id_input
-            st.session_state.local_file = local_file
-            st.session_state.url_input = url_input
+            if transcript_id_input == '' and (local_file is not None or url_input != ''):
+                # upload and transcription run in the background; the next page just polls the job
+                job = transcription_queue().submit(local_file if local_file is not None else url_input, api_key)
+                st.session_state.transcription_job = job.id
             st.session_state.job_description = job_description
             st.session_state.skills = skills
             st.session_state.transcript_text = transcript_text
+            st.session_state.fused = fused
+            st.session_state.pipelined = pipelined
+            st.session_state.candidate = candidate
+            st.session_state.interviewer = interviewer
             st.rerun()
 else: #running or complete page
     api_key = st.session_state.api_key
     if st.session_state.complete == False:
+        job = transcription_queue().get(st.session_state.transcription_job) if st.session_state.transcription_job else None
+        if job is not None and not job.done():
+            st.info(f'Transcribing {job.name}: {job.status}...')
+            if st.button('Cancel'):
+                st.session_state.homepage = True
+                st.session_state.transcription_job = None
+                st.rerun()
+            time.sleep(1)
+            st.rerun()
         st.write('')
-        with st.spinner('Loading...'):
+        # the analysis runs on the shared server pool; this page only polls the job id
+        analysis = analysis_server().get(st.session_state.analysis_job) if st.session_state.analysis_job else None
+        if analysis is None:
             transcript_id_input = st.session_state.transcript_id_input
-            local_file = st.session_state.local_file
-            url_input = st.session_state.url_input
             job_description = st.session_state.job_description
             skills = st.session_state.skills
             transcript_text = st.session_state.transcript_text
 
             if transcript_id_input != '':
                 transcript_id = transcript_id_input
-            elif local_file is not None:
-                file_bytes = local_file.read()
-                file_extension = Path(local_file.name).suffix
-                with open(f'temp_file{file_extension}', 'wb') as temp_file:
-                    temp_file.write(file_bytes)
-                transcript_id = transcribe_file(f'temp_file{file_extension}')
-            elif url_input != '':
-                transcript_id = transcribe_file(url_input)
+            elif st.session_state.transcription_job:
+                if job is None or job.error:
+                    st.error(job.error if job is not None else 'The transcription job was lost, please submit the file again.')
+                    st.stop()
+                transcript_id = job.transcript_id
             elif transcript_text != '':
                 # If transcript text is provided, we don't need to transcribe
                 st.session_state.transcript_text = transcript_text
@@ -545,47 +287,42 @@ else: #running or complete page
                 st.write('Please input a file, URL, or transcript text.')
                 st.stop()
 
-            if transcript_text == '':
-                st.session_state.transcript_text = aai.Transcript.get_by_id(transcript_id).text
-            
-            print('starting q_a_request')
-            q_and_a_arr = get_questions(transcript_id, job_description, api_key, st.session_state.transcript_text)  # Pass transcript_text to get_questions
-            print(q_and_a_arr)
-
-            with ThreadPoolExecutor() as executor:
-                future_1 = executor.submit(candidate_quality_assessment, transcript_id, job_description, skills, api_key, q_and_a_arr, st.session_state.transcript_text)  # Pass transcript_text to candidate_quality_assessment
-                future_2 = executor.submit(interviewer_quality_assessment, transcript_id, job_description, skills, api_key, q_and_a_arr, st.session_state.transcript_text)  # Pass transcript_text to interviewer_quality_assessment
-                future_7 = executor.submit(get_skills, transcript_id, job_description, skills, api_key, q_and_a_arr, st.session_state.transcript_text)  # Pass transcript_text to get_skills
-                future_3 = executor.submit(generate_summary_paragraph, transcript_id, api_key, st.session_state.transcript_text)  # Pass transcript_text to generate_summary_paragraph
-                future_4 = executor.submit(generate_summary_topics, transcript_id, api_key, st.session_state.transcript_text)  # Pass transcript_text to generate_summary_topics
-                future_6 = executor.submit(generate_question_answer, transcript_id, api_key, st.session_state.transcript_text)  # Pass transcript_text to generate_question_answer
-
-            skills = future_7.result()
-            temp_candidate_assessment = future_1.result()
-            temp_interviewer_audit = future_2.result()
-
-            for i in range(len(temp_candidate_assessment)):
-                try:
-                    skill = skills[i]['skill']
-                    temp_candidate_assessment[i]['skill'] = skill
-                    temp_interviewer_audit[i]['skill'] = skill
-                except: pass
-
-            st.session_state.parsed_candidate_assessment = temp_candidate_assessment
-            st.session_state.parsed_interviewer_audit = temp_interviewer_audit
-            
-            st.session_state.summary_paragraph = future_3.result()
-            st.session_state.summary_topics = future_4.result()
-            st.session_state.question_answer = future_6.result()
-            st.session_state.complete = True
+            analysis = analysis_server().submit(transcript_id, job_description, skills, api_key, st.session_state.transcript_text,
+                                                fused=st.session_state.fused, pipelined=st.session_state.pipelined,
+                                                save={'candidate': st.session_state.candidate, 'job': job_title(job_description),
+                                                      'interviewer': st.session_state.interviewer},
+                                                previous=st.session_state.previous_result)
+            st.session_state.analysis_job = analysis.id
+        if not analysis.done():
+            st.info(f'Analyzing {analysis.name}: {analysis.status}...')
+            render_progress(*analysis.snapshot())
+            time.sleep(1)
+            st.rerun()
+        if analysis.error:
+            st.error(analysis.error)
+            st.stop()
+
+        show_result(analysis.result)
+        st.session_state.previous_result = None
+        # swap the streamed sections for the regular results view
+        st.rerun()
     
     st.write('')
+    if st.session_state.result is not None:
+        with st.expander('Edit the job description or skills and re-analyze'):
+            st.caption('Only the stages that read what changed run again: summaries are always reused, extracted questions too when only the skills change or they came from speaker labels.')
+            st.text_area('Job description', value=st.session_state.job_description, key='edit_job_description')
+            st.text_area('Skills list', value=st.session_state.skills, key='edit_skills')
+            st.button('Re-analyze', on_click=reanalyze)
+
     button2 = st.button('RESET')
     if button2:
         st.session_state.homepage = True
         st.session_state.transcript_id_input = ''
-        st.session_state.local_file = None
-        st.session_state.url_input = ''
+        st.session_state.transcription_job = None
+        st.session_state.analysis_job = None
+        st.session_state.result = None
+        st.session_state.previous_result = None
         st.session_state.job_description = ''
         st.session_state.skills = ''
         st.session_state.transcript_text = ''
@@ -597,46 +334,41 @@ else: #running or complete page
         st.session_state.question_answer = ''
         st.rerun()
 
+    if cache_enabled():
+        cache_stats = get_cache().stats()
+        st.caption(f"LeMUR cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+
+    stage_timings = metrics.recorder.summary(interview=st.session_state.get('transcript_id', ''))
+    if stage_timings:
+        with st.expander('Stage timings'):
+            st.table({stage: {'seconds': round(s['max'], 2), 'retries': s['retries'], 'cached': s['cache_hits'] > 0,
+                              'input tokens': s['input_tokens'], 'output tokens': s['output_tokens'],
+                              'tokens saved (est.)': s['saved_tokens'], 'cost (est. $)': round(s['cost'], 4)}
+                      for stage, s in stage_timings.items()})
+
+    # components only the results page uses
+    import st_btn_select
+    import streamlit_scrollable_textbox as stx
+
     st.subheader('Transcript Text:')
-    stx.scrollableTextbox(st.session_state.transcript_text)
+    stx.scrollableTextbox(page_of(transcript_pages(st.session_state.transcript_text or ''), 'transcript_page', 1)[0])
     st.markdown('\n' * 1)
 
     option = st_btn_select.st_btn_select(('Paragraph Summary', 'Topic Summary', 'Basic Question-Answer', 'Candidate Assessment', 'Interviewer Assessment'), index=0)
     
     if option == 'Candidate Assessment':
-        st.subheader('Candidate Assessment')
-        for q in st.session_state.parsed_candidate_assessment:
-            st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
-            st.write('Question: ' + q['question'])
-            st.write('Answer: ' + q['answer'])
-            st.write('Skill: ' + q['skill'])
-            st.write('Grade: ' + str(q['grade']))
-        st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
-        st.write('Quality Score: '+str(calculateQualityScore(st.session_state.parsed_candidate_assessment)*100))
-        st.write('Quality score formula: (total points)/(5 * # of questions *)')
+        render_candidate_assessment(st.session_state.parsed_candidate_assessment, page_key='candidate_page')
 
     if option == 'Interviewer Assessment':
-        st.subheader('Interviewer Assessment')
-        for q in st.session_state.parsed_interviewer_audit:
-            st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
-            st.write('Question: ' + q['question'])
-            st.write('Grade: ' + str(q['grade']))
-            st.write('Skill: ' + q['skill'])
-        st.markdown('~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ')
-        st.write('Quality Score: '+str(calculateQualityScore(st.session_state.parsed_interviewer_audit)*100))
-        st.write('Quality score formula: (total points)/(5 * # of questions *)')
+        render_interviewer_assessment(st.session_state.parsed_interviewer_audit, page_key='interviewer_page')
 
     if option == 'Paragraph Summary':
-        st.subheader('Paragraph Summary')
-        st.write(st.session_state.summary_paragraph)
+        render_summary_paragraph(st.session_state.summary_paragraph)
 
     if option == 'Topic Summary':
-        st.subheader('Topic Summary')
-        st.write(st.session_state.summary_topics)
+        render_summary_topics(st.session_state.summary_topics)
 
     if option == 'Basic Question-Answer':
-        st.subheader('Basic Question-Answer')
-        for q in st.session_state.question_answer:
-            st.write(f'{q.question}')
-            st.write(f'Answer: {q.answer}')
-            st.write()
\ No newline at end of file
+        render_question_answer(st.session_state.question_answer)
+
+metrics.record_page_run(time.perf_counter() - script_started, first_run)
@@ -0,0 +1,113 @@
+import difflib
+import hashlib
+import re
+
+# Joining response items to their questions, and the scores shown for them. Nothing here touches
+# the SDK, so the UI and the results store load it without the rest of the analysis engine.
+
+
+def calculateQualityScore(arr):
+    points = 0
+    total = 0
+    for n in arr:
+        try:
+            grade = int(n['grade'])
+            total += 5
+            points += grade
+        except:
+            pass  # If grade is not convertible to int, do nothing
+    if total == 0:
+        return 0  # Avoid division by zero
+    return points / total
+
+
+def normalize_question(question):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', question.lower()).split())
+
+
+def question_id(question):
+    # derived from the question itself, so the same question gets the same id on every run
+    return 'q' + hashlib.sha1(normalize_question(question).encode('utf-8')).hexdigest()[:8]
+
+
+def assign_question_ids(q_and_a_arr):
+    # gives every pair an 'id' the grading stages echo back; pairs that already have one keep it
+    taken = {pair['id'] for pair in q_and_a_arr if pair.get('id')}
+    for pair in q_and_a_arr:
+        if pair.get('id'):
+            continue
+        base = question_id(pair['question'])
+        qid, n = base, 1
+        while qid in taken:
+            n += 1
+            qid = f'{base}-{n}'
+        pair['id'] = qid
+        taken.add(qid)
+    return q_and_a_arr
+
+
+def match_items(q_and_a_arr, items, ratio=0.85, pair_leftovers=False):
+    # returns, for each input pair, the index of the response item that answers it (or None);
+    # a matching id wins, then exact question text, then close matches. Items matching none of
+    # these stay unmatched, so the pair counts as missing and is asked for again; only with
+    # pair_leftovers do leftover items pair up with leftover pairs in order
+    matches = [None] * len(q_and_a_arr)
+    used = set()
+    by_id = {}
+    for i, item in enumerate(items):
+        if item.get('id') is not None:
+            by_id.setdefault(str(item['id']), i)
+    for n, pair in enumerate(q_and_a_arr):
+        i = by_id.get(str(pair.get('id')))
+        if pair.get('id') is not None and i is not None and i not in used:
+            matches[n] = i
+            used.add(i)
+    keys = [normalize_question(item.get('question', '')) for item in items]
+    wanted = [normalize_question(pair.get('question', '')) for pair in q_and_a_arr]
+    for close_match in (False, True):
+        for n, key in enumerate(wanted):
+            if matches[n] is not None:
+                continue
+            for i, k in enumerate(keys):
+                if i not in used and (k == key or close_match and difflib.SequenceMatcher(None, key, k).ratio() >= ratio):
+                    matches[n] = i
+                    used.add(i)
+                    break
+    if not pair_leftovers:
+        return matches
+    leftovers = iter(i for i in range(len(items)) if i not in used)
+    return [match if match is not None else next(leftovers, None) for match in matches]
+
+
+def align_items(q_and_a_arr, items):
+    # response order follows q_and_a_arr, and every item carries the id of the pair it answers
+    # even if the model left it out or mangled it
+    aligned = []
+    for pair, match in zip(q_and_a_arr, match_items(q_and_a_arr, items)):
+        if match is not None:
+            item = dict(items[match])
+            if pair.get('id'):
+                item['id'] = pair['id']
+            aligned.append(item)
+    return aligned
+
+
+def restore_answers(q_and_a_arr, items):
+    # graders echo answers back, maybe as a reference to a tagged passage (see
+    # encode_grading_input); the answer shown is always the one that was extracted
+    for item, match in zip(items, match_items(items, q_and_a_arr, pair_leftovers=False)):
+        if match is not None and 'answer' in item:
+            item['answer'] = q_and_a_arr[match].get('answer', item['answer'])
+    return items
+
+
+def pair_assessments(candidate_assessment, interviewer_audit):
+    # (candidate item, interviewer item) per question, joined by id; results saved before ids
+    # existed fall back to position
+    if all(isinstance(item, dict) and item.get('id') for item in candidate_assessment + interviewer_audit):
+        audits = {item['id']: item for item in interviewer_audit}
+        pairs = [(item, audits.pop(item['id'], None)) for item in candidate_assessment]
+        return pairs + [(None, item) for item in interviewer_audit if item['id'] in audits]
+    return [(candidate_assessment[i] if i < len(candidate_assessment) else None,
+             interviewer_audit[i] if i < len(interviewer_audit) else None)
+            for i in range(max(len(candidate_assessment), len(interviewer_audit)))]
@@ -0,0 +1,249 @@
+import collections
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+from routing import request_cost
+
+# label attached to every record made while an interview is being analyzed
+current_interview = contextvars.ContextVar('current_interview', default='')
+
+_local = threading.local()
+
+# seconds one run of the Streamlit script may take: the first run of a session (imports, store,
+# first render) and every rerun after a click. Slower runs are logged and recorded as not ok.
+UI_STARTUP_BUDGET = float(os.environ.get('UI_STARTUP_BUDGET', 1.0))
+UI_RERUN_BUDGET = float(os.environ.get('UI_RERUN_BUDGET', 0.25))
+
+
+def percentile(values, q):
+    # linear interpolation between closest ranks, q in [0, 100]
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class MetricsRecorder:
+    # keeps the most recent records only, so a long-running Streamlit server does not grow forever
+    def __init__(self, max_records=50000):
+        self.records = collections.deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+    def snapshot(self, interview=None):
+        with self._lock:
+            records = list(self.records)
+        if interview is not None:
+            records = [r for r in records if r['interview'] == interview]
+        return records
+
+    def summary(self, interview=None):
+        stages = {}
+        for record in self.snapshot(interview):
+            stages.setdefault(record['stage'], []).append(record)
+        summary = {}
+        for stage, records in stages.items():
+            durations = [r['wall_time'] for r in records]
+            summary[stage] = {
+                'count': len(records),
+                'errors': sum(1 for r in records if not r['ok']),
+                'cache_hits': sum(1 for r in records if r['cache_hit']),
+                'retries': sum(r['retries'] for r in records),
+                'mean': sum(durations) / len(durations),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'p99': percentile(durations, 99),
+                'max': max(durations),
+                'input_chars': sum(r['input_chars'] for r in records),
+                'output_chars': sum(r['output_chars'] for r in records),
+                'input_tokens': sum(r['input_tokens'] for r in records),
+                'output_tokens': sum(r['output_tokens'] for r in records),
+                'saved_chars': sum(r.get('saved_chars', 0) for r in records),
+                'cost': sum(r.get('cost', 0.0) for r in records),
+            }
+            # about four characters per token, like the grading batch estimate
+            summary[stage]['saved_tokens'] = summary[stage]['saved_chars'] // 4
+        return summary
+
+    def route_summary(self, interview=None):
+        # one row per (stage, model): every LeMUR request, including the ones a route escalated past
+        routes = {}
+        for record in self.snapshot(interview):
+            for request in record.get('requests', []):
+                routes.setdefault((record['stage'], request['model']), []).append(request)
+        rows = []
+        for (stage, model), requests in routes.items():
+            durations = [r['seconds'] for r in requests]
+            rows.append({
+                'stage': stage, 'model': model, 'requests': len(requests),
+                'invalid': sum(1 for r in requests if not r['valid']),
+                'p50': percentile(durations, 50), 'p95': percentile(durations, 95),
+                'input_tokens': sum(r['input_tokens'] for r in requests),
+                'output_tokens': sum(r['output_tokens'] for r in requests),
+                'cost': sum(r['cost'] for r in requests),
+            })
+        return rows
+
+    def to_json(self, interview=None):
+        return json.dumps({'records': self.snapshot(interview), 'summary': self.summary(interview),
+                           'routes': self.route_summary(interview)}, indent=2)
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = [
+            '# HELP lemur_stage_duration_seconds Wall time of each analysis stage.',
+            '# TYPE lemur_stage_duration_seconds summary',
+        ]
+        for stage, s in summary.items():
+            for q in ('0.5', '0.95', '0.99'):
+                value = s['p' + str(int(float(q) * 100))]
+                lines.append(f'lemur_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'lemur_stage_duration_seconds_sum{{stage="{stage}"}} {s["mean"] * s["count"]:.6f}')
+            lines.append(f'lemur_stage_duration_seconds_count{{stage="{stage}"}} {s["count"]}')
+        counters = [
+            ('lemur_stage_errors_total', 'errors', 'Stage runs that raised.'),
+            ('lemur_stage_cache_hits_total', 'cache_hits', 'Stage runs answered from the result cache.'),
+            ('lemur_stage_retries_total', 'retries', 'Retried LeMUR/transcription requests.'),
+            ('lemur_stage_input_chars_total', 'input_chars', 'Characters of prompt and transcript sent.'),
+            ('lemur_stage_output_chars_total', 'output_chars', 'Characters of response received.'),
+            ('lemur_stage_input_tokens_total', 'input_tokens', 'LeMUR input tokens reported by the API.'),
+            ('lemur_stage_output_tokens_total', 'output_tokens', 'LeMUR output tokens reported by the API.'),
+            ('lemur_stage_saved_input_chars_total', 'saved_chars', 'Input characters removed by prompt compaction.'),
+        ]
+        for name, key, help_text in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for stage, s in summary.items():
+                lines.append(f'{name}{{stage="{stage}"}} {s[key]}')
+        route_counters = [
+            ('lemur_route_requests_total', 'requests', 'LeMUR requests per stage and model.'),
+            ('lemur_route_invalid_total', 'invalid', 'Responses that failed validation (escalated or retried).'),
+            ('lemur_route_cost_usd_total', 'cost', 'Estimated LeMUR cost in USD.'),
+        ]
+        routes = self.route_summary()
+        for name, key, help_text in route_counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for r in routes:
+                lines.append(f'{name}{{stage="{r["stage"]}",model="{r["model"]}"}} {r[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+recorder = MetricsRecorder()
+
+
+def new_record(stage):
+    return {
+        'stage': stage, 'interview': current_interview.get(), 'started_at': time.time(), 'wall_time': 0.0,
+        'ok': True, 'cache_hit': False, 'retries': 0, 'input_chars': 0, 'output_chars': 0,
+        'input_tokens': 0, 'output_tokens': 0, 'saved_chars': 0, 'cost': 0.0,
+        # one entry per LeMUR request: model, seconds, tokens, cost and whether the response validated
+        'requests': [],
+    }
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _current():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def instrumented(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            record = new_record(stage)
+            _stack().append(record)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                record['ok'] = False
+                raise
+            finally:
+                record['wall_time'] = time.perf_counter() - start
+                _stack().pop()
+                recorder.add(record)
+        return wrapper
+    return decorator
+
+
+def record_duration(stage, seconds, ok=True):
+    record = new_record(stage)
+    record['wall_time'] = seconds
+    record['ok'] = ok
+    recorder.add(record)
+
+
+def record_page_run(seconds, first_run):
+    stage, budget = ('ui_startup', UI_STARTUP_BUDGET) if first_run else ('ui_rerun', UI_RERUN_BUDGET)
+    if seconds > budget:
+        print(f'{stage} took {seconds:.2f}s, over the {budget:.2f}s budget')
+    record_duration(stage, seconds, ok=seconds <= budget)
+
+
+# The helpers below are called from deep inside a stage (retry loop, backend, cache) and
+# attribute their numbers to whichever instrumented stage is running on this thread.
+
+def note_retry():
+    record = _current()
+    if record is not None:
+        record['retries'] += 1
+
+
+def note_cache_hit():
+    record = _current()
+    if record is not None:
+        record['cache_hit'] = True
+
+
+def note_request(input_chars, output_chars, usage=None, model=None, seconds=0.0):
+    record = _current()
+    if record is None:
+        return
+    record['input_chars'] += input_chars
+    record['output_chars'] += output_chars
+    if usage is not None:
+        record['input_tokens'] += usage.input_tokens
+        record['output_tokens'] += usage.output_tokens
+        input_tokens, output_tokens = usage.input_tokens, usage.output_tokens
+    else:
+        input_tokens, output_tokens = input_chars // 4, output_chars // 4
+    model = str(model) if model else 'default'
+    cost = request_cost(model, input_tokens, output_tokens)
+    record['cost'] += cost
+    record['requests'].append({'model': model, 'seconds': seconds, 'input_tokens': input_tokens,
+                               'output_tokens': output_tokens, 'cost': cost, 'valid': True})
+
+
+def note_invalid():
+    # the last request's response failed validation
+    record = _current()
+    if record is not None and record['requests']:
+        record['requests'][-1]['valid'] = False
+
+
+def note_saved(chars):
+    # input characters compaction removed before the request was sent
+    record = _current()
+    if record is not None:
+        record['saved_chars'] += chars
@@ -0,0 +1,387 @@
+import asyncio
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis import (
+    get_transcript_text, get_questions, get_skills, candidate_quality_assessment,
+    interviewer_quality_assessment, generate_summary_paragraph, generate_summary_topics,
+    generate_question_answer, merge_skills, fused_grading, split_fused_grading, fill_missing,
+    wait_for_transcript,
+)
+from batching import BATCHED_STAGES
+from chunking import (
+    is_long_transcript, extract_questions_chunked, grade_in_batches, extract_and_grade, assign_chunks, WINDOW_CHARS,
+    PIPELINE_WINDOW_CHARS,
+)
+from fanout import FanOut, RequestSlot
+from matching import align_items, assign_question_ids
+import metrics
+from segment import LOCAL_SEGMENTER, segment_questions, utterance_dicts, utterances_from_text
+
+DEFAULT_CONCURRENCY = 8
+# transcripts pasted into the UI (or posted without an id) all carry this placeholder id
+PASTED_TRANSCRIPT_ID = 'temp_transcript_id'
+# where the questions came from; segmented questions never read the job description
+SPEAKER_LABELS = 'speaker_labels'
+LEMUR = 'lemur'
+
+
+class Stage:
+    def __init__(self, name, fn, deps=(), inputs=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        # context keys the stage reads besides the transcript and its deps; a re-analysis
+        # reuses the previous result of a stage when none of these and none of its deps changed
+        self.inputs = tuple(inputs)
+
+    def run(self, ctx, *dep_results):
+        return self.fn(ctx, *dep_results)
+
+
+def transcript_utterances(ctx, text):
+    # speaker turns for the local segmenter: the "Speaker A: ..." lines of a pasted transcript, or
+    # the utterances of a real one, also when its text came along (a re-analysis sends the stored text)
+    if not LOCAL_SEGMENTER:
+        return []
+    if ctx['transcript_id'] == PASTED_TRANSCRIPT_ID:
+        return utterances_from_text(text)
+    try:
+        return utterance_dicts(wait_for_transcript(ctx['transcript_id'], ctx['api_key']).utterances)
+    except Exception as e:
+        print(f'Could not fetch the utterances of {ctx["transcript_id"]}: {e}')
+        return utterances_from_text(text)
+
+
+def segmented_questions(ctx, text):
+    q_and_a_arr = segment_questions(transcript_utterances(ctx, text))
+    ctx['questions_source'] = LEMUR if q_and_a_arr is None else SPEAKER_LABELS
+    if q_and_a_arr is not None and is_long_transcript(text, ctx['long_mode']):
+        assign_chunks(q_and_a_arr, text)
+    return q_and_a_arr
+
+
+def extract_questions(ctx, text):
+    # speaker labels usually give the questions without a LeMUR call; get_questions is the fallback
+    q_and_a_arr = segmented_questions(ctx, text)
+    if q_and_a_arr is not None:
+        return assign_question_ids(q_and_a_arr)
+    if is_long_transcript(text, ctx['long_mode']):
+        return extract_questions_chunked(text, ctx['jd'], ctx['api_key'])
+    return assign_question_ids(get_questions(ctx['transcript_id'], ctx['jd'], ctx['api_key'], text))
+
+
+def report_graded(ctx, name, batch, items):
+    # hands each graded batch to on_graded as soon as it is back, before the rest of the stage;
+    # a fused batch is reported as the candidate and interviewer grades it holds
+    if ctx['on_graded'] is None:
+        return
+    if name == 'fused_grading':
+        split = split_fused_grading(items, batch)
+        if split is not None:
+            ctx['on_graded']('skills', split[0])
+            ctx['on_graded']('parsed_candidate_assessment', split[1])
+            ctx['on_graded']('parsed_interviewer_audit', split[2])
+        return
+    ctx['on_graded'](name, items)
+
+
+def grader(ctx, fn, name):
+    def grade(batch, batch_text):
+        def request(subset):
+            return fn(ctx['transcript_id'], ctx['jd'], ctx['skills'], ctx['api_key'], subset, batch_text)
+        items = fill_missing(request, batch, request(batch))
+        report_graded(ctx, name, batch, items)
+        return items
+    return grade
+
+
+def grade_all(ctx, grade, text, q_and_a_arr):
+    # long transcripts are graded in batches small enough that the response is never truncated
+    if is_long_transcript(text, ctx['long_mode']):
+        return grade_in_batches(grade, q_and_a_arr, text)
+    return grade(q_and_a_arr, text)
+
+
+def grading_stage(name):
+    def run(ctx, text, q_and_a_arr):
+        return grade_all(ctx, grader(ctx, fused_grading if name == 'fused_grading' else GRADING_FUNCTIONS[name], name), text, q_and_a_arr)
+    return run
+
+
+GRADING_FUNCTIONS = {
+    'skills': get_skills,
+    'parsed_candidate_assessment': candidate_quality_assessment,
+    'parsed_interviewer_audit': interviewer_quality_assessment,
+}
+
+
+# Each stage receives the interview context followed by the results of its deps.
+# The summaries only need the transcript, so they start alongside get_questions.
+STAGES = [
+    Stage('transcript_text', lambda ctx: ctx['transcript_text'] or get_transcript_text(ctx['transcript_id'], ctx['api_key'])),
+    Stage('q_and_a_arr', extract_questions, deps=['transcript_text'], inputs=['jd']),
+    Stage('skills', grading_stage('skills'), deps=['transcript_text', 'q_and_a_arr'],
+          inputs=['jd', 'skills']),
+    Stage('parsed_candidate_assessment', grading_stage('parsed_candidate_assessment'),
+          deps=['transcript_text', 'q_and_a_arr'], inputs=['jd', 'skills']),
+    Stage('parsed_interviewer_audit', grading_stage('parsed_interviewer_audit'),
+          deps=['transcript_text', 'q_and_a_arr'], inputs=['jd', 'skills']),
+    Stage('summary_paragraph', lambda ctx, text: generate_summary_paragraph(ctx['transcript_id'], ctx['api_key'], text),
+          deps=['transcript_text']),
+    Stage('summary_topics', lambda ctx, text: generate_summary_topics(ctx['transcript_id'], ctx['api_key'], text),
+          deps=['transcript_text']),
+    Stage('question_answer', lambda ctx, text: generate_question_answer(ctx['transcript_id'], ctx['api_key'], text),
+          deps=['transcript_text']),
+]
+
+GRADING_STAGES = ('skills', 'parsed_candidate_assessment', 'parsed_interviewer_audit')
+
+
+def run_fused_grading(ctx, text, q_and_a_arr):
+    try:
+        fused_arr = grading_stage('fused_grading')(ctx, text, q_and_a_arr)
+    except Exception as e:
+        print(f'Fused grading failed, falling back to separate calls: {e}')
+        return None
+    return validate_fused(fused_arr, q_and_a_arr)
+
+
+def validate_fused(fused_arr, q_and_a_arr):
+    split = split_fused_grading(fused_arr, q_and_a_arr)
+    if split is None:
+        print('Fused grading output did not validate, falling back to separate calls')
+    return split
+
+
+def pipelined_stage(fused):
+    # extraction and grading as one stage: each chunk is graded as soon as its questions are out
+    def run(ctx, text):
+        if fused:
+            grade = grader(ctx, fused_grading, 'fused_grading')
+            def fused_grade(batch, batch_text):
+                try:
+                    return grade(batch, batch_text)
+                except Exception as e:
+                    print(f'Fused grading failed, falling back to separate calls: {e}')
+                    return []
+            graders = {'fused_grading': fused_grade}
+        else:
+            graders = {name: grader(ctx, fn, name) for name, fn in GRADING_FUNCTIONS.items()}
+        q_and_a_arr = segmented_questions(ctx, text)
+        if q_and_a_arr is not None:
+            # the questions are known up front, so there is no extraction to overlap with
+            assign_question_ids(q_and_a_arr)
+            with FanOut(len(graders)) as executor:
+                futures = {name: executor.submit(grade_all, ctx, grade, text, q_and_a_arr) for name, grade in graders.items()}
+                graded = {name: align_items(q_and_a_arr, future.result()) for name, future in futures.items()}
+            graded['q_and_a_arr'] = q_and_a_arr
+            return graded
+        window_chars = WINDOW_CHARS if is_long_transcript(text, ctx['long_mode']) else PIPELINE_WINDOW_CHARS
+        q_and_a_arr, graded = extract_and_grade(text, ctx['jd'], ctx['api_key'], graders, window_chars)
+        graded['q_and_a_arr'] = q_and_a_arr
+        return graded
+    return run
+
+
+def pick(key):
+    return lambda ctx, pipelined: pipelined[key]
+
+
+def fused_or_separate(stage, index):
+    # use the fused result when it validated, otherwise run the original stage
+    def run(ctx, text, q_and_a_arr, fused):
+        if fused is not None:
+            return fused[index]
+        return stage.run(ctx, text, q_and_a_arr)
+    return Stage(stage.name, run, deps=['transcript_text', 'q_and_a_arr', 'fused_grading'], inputs=stage.inputs)
+
+
+def batched_summaries(batcher):
+    # the three summary stages of this interview, sent together with other interviews' by the batcher
+    def run(ctx, text):
+        return batcher.submit(ctx['transcript_id'], text, ctx['api_key']).result()
+    return run
+
+
+def with_batched_summaries(stages, batcher):
+    result = []
+    for stage in stages:
+        if stage.name in BATCHED_STAGES:
+            stage = Stage(stage.name, pick(stage.name), deps=['summaries'])
+        result.append(stage)
+        if stage.name == 'transcript_text':
+            result.append(Stage('summaries', batched_summaries(batcher), deps=['transcript_text']))
+    return result
+
+
+def build_stages(fused=False, pipelined=False, batcher=None):
+    if batcher is not None:
+        return with_batched_summaries(build_stages(fused, pipelined), batcher)
+    if not fused and not pipelined:
+        return STAGES
+    stages = []
+    if pipelined:
+        stages.append(Stage('pipelined', pipelined_stage(fused), deps=['transcript_text'], inputs=['jd', 'skills']))
+    if fused and pipelined:
+        stages.append(Stage('fused_grading', lambda ctx, p: validate_fused(p['fused_grading'], p['q_and_a_arr']), deps=['pipelined']))
+    elif fused:
+        stages.append(Stage('fused_grading', run_fused_grading, deps=['transcript_text', 'q_and_a_arr'], inputs=['jd', 'skills']))
+    for stage in STAGES:
+        if pipelined and stage.name == 'q_and_a_arr':
+            stage = Stage(stage.name, pick(stage.name), deps=['pipelined'])
+        elif fused and stage.name in GRADING_STAGES:
+            stage = fused_or_separate(stage, GRADING_STAGES.index(stage.name))
+        elif pipelined and stage.name in GRADING_STAGES:
+            stage = Stage(stage.name, pick(stage.name), deps=['pipelined'])
+        stages.append(stage)
+    return stages
+
+
+def same_transcript(ctx, previous):
+    if previous.get('transcript_id') != ctx['transcript_id']:
+        return False
+    # pasted transcripts all share the temporary id, so their text has to match too
+    return not ctx['transcript_text'] or ctx['transcript_text'] == previous.get('transcript_text')
+
+
+def reusable_stages(stages, ctx, previous):
+    # names of the stages whose previous result is still valid: same transcript, same inputs,
+    # and every dep reusable too (stages are listed after their deps)
+    if not previous or not same_transcript(ctx, previous):
+        return set()
+    inputs = previous.get('inputs') or {}
+    reusable = set()
+    for stage in stages:
+        if stage.name in previous and all(ctx[key] == inputs.get(key) for key in stage_inputs(stage, previous)) \
+                and all(dep in reusable for dep in stage.deps):
+            reusable.add(stage.name)
+    return reusable
+
+
+def stage_inputs(stage, previous):
+    # questions segmented from speaker labels did not read the job description, so an edited one
+    # does not invalidate them
+    if stage.name == 'q_and_a_arr' and previous.get('questions_source') == SPEAKER_LABELS:
+        return ()
+    return stage.inputs
+
+
+def previous_result(name, previous):
+    value = copy.deepcopy(previous[name])
+    if name == 'q_and_a_arr':
+        # stored results may predate question ids
+        assign_question_ids(value)
+
+        def reuse(ctx):
+            ctx['questions_source'] = previous.get('questions_source')
+            return value
+        return reuse
+    return lambda ctx: value
+
+
+def with_previous_results(stages, previous, reusable):
+    if reusable:
+        print(f"Re-analysis: reusing {', '.join(sorted(reusable))}")
+    return [Stage(stage.name, previous_result(stage.name, previous)) if stage.name in reusable else stage
+            for stage in stages]
+
+
+def make_context(transcript_id, jd, skills, api_key, transcript_text='', long_mode=None, on_graded=None):
+    # long_mode: None decides from the transcript length, True/False forces chunked analysis on/off;
+    # on_graded(stage name, items) is called from worker threads with each graded batch;
+    # questions_source is set by the question extraction
+    return {'transcript_id': transcript_id, 'jd': jd, 'skills': skills, 'api_key': api_key,
+            'transcript_text': transcript_text, 'long_mode': long_mode, 'on_graded': on_graded,
+            'questions_source': None}
+
+
+async def run_stages(ctx, stages=STAGES, semaphore=None, on_stage_done=None):
+    # stage calls are blocking SDK requests, so they run in worker threads while the
+    # event loop schedules each one as soon as everything it depends on is done
+    semaphore = semaphore or asyncio.Semaphore(DEFAULT_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    tasks = {}
+
+    async def run(stage):
+        dep_results = [await tasks[dep] for dep in stage.deps]
+        # the slot is taken in the stage's thread (see fanout.py)
+        result = await asyncio.to_thread(RequestSlot(loop, semaphore).call, stage.run, ctx, *dep_results)
+        # callbacks run on the event loop thread, i.e. the thread that called run_event_loop
+        if on_stage_done is not None:
+            on_stage_done(stage.name, result)
+        return result
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    except Exception:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
+
+
+def assemble_result(ctx, results):
+    candidate_assessment = results['parsed_candidate_assessment']
+    interviewer_audit = results['parsed_interviewer_audit']
+    merge_skills(candidate_assessment, interviewer_audit, results['skills'])
+    return {
+        'transcript_id': ctx['transcript_id'],
+        'transcript_text': results['transcript_text'],
+        'q_and_a_arr': results['q_and_a_arr'],
+        'questions_source': ctx['questions_source'],
+        'parsed_candidate_assessment': candidate_assessment,
+        'parsed_interviewer_audit': interviewer_audit,
+        'summary_paragraph': results['summary_paragraph'],
+        'summary_topics': results['summary_topics'],
+        'question_answer': results['question_answer'],
+        # kept with the result so a later re-analysis can tell which stages are still valid
+        'inputs': {'jd': ctx['jd'], 'skills': ctx['skills']},
+    }
+
+
+async def run_pipeline(transcript_id, jd, skills, api_key, transcript_text='', semaphore=None, fused=False, on_stage_done=None,
+                       long_mode=None, pipelined=False, previous=None, batcher=None, on_graded=None):
+    # previous: an earlier result for the same transcript (analyze_interview's dict or
+    # ResultStore.get); only the stages whose inputs changed since then are run again.
+    # batcher: a batching.SummaryBatcher shared by the interviews of a batch run
+    ctx = make_context(transcript_id, jd, skills, api_key, transcript_text, long_mode, on_graded)
+    reusable = reusable_stages(STAGES, ctx, previous)
+    # with the questions reused there is no extraction left to overlap grading with
+    pipelined = pipelined and 'q_and_a_arr' not in reusable
+    if set(BATCHED_STAGES) <= reusable:
+        batcher = None
+    stages = build_stages(fused, pipelined, batcher)
+    stages = with_previous_results(stages, previous, reusable_stages(stages, ctx, previous))
+    # tasks and worker threads copy the current context, so every stage record gets this label
+    metrics.current_interview.set(transcript_id)
+    start = time.perf_counter()
+    try:
+        results = await run_stages(ctx, stages, semaphore=semaphore, on_stage_done=on_stage_done)
+    except Exception:
+        metrics.record_duration('end_to_end', time.perf_counter() - start, ok=False)
+        raise
+    metrics.record_duration('end_to_end', time.perf_counter() - start)
+    return assemble_result(ctx, results)
+
+
+def run_event_loop(coro, concurrency=DEFAULT_CONCURRENCY):
+    # asyncio.to_thread uses the loop's default executor; size it to the stage
+    # concurrency so a large batch does not spawn more threads than it can use
+    async def main():
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        loop.set_default_executor(executor)
+        return await coro
+    return asyncio.run(main())
+
+
+def analyze_interview(transcript_id, jd, skills, api_key, transcript_text='', fused=False, on_stage_done=None, long_mode=None,
+                      pipelined=False, previous=None):
+    return run_event_loop(run_pipeline(transcript_id, jd, skills, api_key, transcript_text, fused=fused,
+                                       on_stage_done=on_stage_done, long_mode=long_mode, pipelined=pipelined,
+                                       previous=previous))
@@ -0,0 +1,182 @@
+import functools
+import os
+import random
+import re
+import threading
+import time
+
+import assemblyai as aai
+
+import metrics
+
+DEFAULT_RATE = float(os.environ.get('LEMUR_RATE', 2))
+DEFAULT_MAX_RATE = float(os.environ.get('LEMUR_MAX_RATE', 20))
+DEFAULT_MIN_RATE = float(os.environ.get('LEMUR_MIN_RATE', 0.1))
+DEFAULT_BURST = float(os.environ.get('LEMUR_BURST', 4))
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+RATE_LIMIT_PATTERN = re.compile(r'\b429\b|too many requests|rate limit', re.IGNORECASE)
+RETRY_AFTER_PATTERN = re.compile(r'retry[- _]after\D{0,10}(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+
+class RateLimitedError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RetriesExhaustedError(Exception):
+    pass
+
+
+class RateLimiter:
+    # Token bucket whose refill rate follows AIMD: every success nudges the rate up,
+    # every 429 halves it and pauses all callers until the server's Retry-After passes.
+    def __init__(self, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE,
+                 burst=DEFAULT_BURST, increase=0.1, decrease=0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = burst
+        self.resume_at = 0.0
+        self.rate_limited_count = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.resume_at - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate_limited_count += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+            if retry_after:
+                self.resume_at = max(self.resume_at, now + retry_after)
+
+
+class RetryBudget:
+    # Process-wide retry allowance: each retry spends a token and each success earns back
+    # a fraction of one. When the API is failing for everyone the budget runs dry and all
+    # stages stop retrying together instead of each burning through its own attempts.
+    def __init__(self, max_tokens=20, refill_per_success=0.2):
+        self.max_tokens = max_tokens
+        self.refill_per_success = refill_per_success
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.refill_per_success)
+
+
+limiter = RateLimiter()
+retry_budget = RetryBudget()
+
+
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_info(error):
+    # returns (is_rate_limited, retry_after_seconds)
+    if isinstance(error, RateLimitedError):
+        return True, error.retry_after
+    message = str(error)
+    if not RATE_LIMIT_PATTERN.search(message):
+        return False, None
+    match = RETRY_AFTER_PATTERN.search(message)
+    return True, parse_retry_after(match.group(1)) if match else None
+
+
+def raise_on_rate_limit(response):
+    # the SDK turns every non-200 into a LemurError/TranscriptError with only the error
+    # text, so catch 429s at the HTTP layer where the status and Retry-After are visible
+    if response.status_code == 429:
+        retry_after = parse_retry_after(response.headers.get('retry-after'))
+        raise RateLimitedError(f'429 Too Many Requests: {response.request.url}', retry_after)
+
+
+def install_hook(client=None):
+    if client is None:
+        if not aai.settings.api_key:
+            return
+        client = aai.Client.get_default()
+    hooks = client.http_client.event_hooks
+    if raise_on_rate_limit not in hooks['response']:
+        hooks['response'].append(raise_on_rate_limit)
+        client.http_client.event_hooks = hooks
+
+
+def backoff_delay(attempt, retry_after=None):
+    # full jitter keeps parallel stages from retrying in lockstep
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        delay += retry_after
+    return delay
+
+
+def with_backoff(max_attempts=10, rate_limited_only=False):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                limiter.acquire()
+                install_hook()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    rate_limited, retry_after = rate_limit_info(e)
+                    if rate_limited:
+                        limiter.on_rate_limited(retry_after)
+                    if attempt + 1 >= max_attempts or (rate_limited_only and not rate_limited):
+                        raise
+                    if not retry_budget.withdraw():
+                        raise RetriesExhaustedError(f'{fn.__name__}: retry budget exhausted, giving up') from e
+                    delay = backoff_delay(attempt, retry_after)
+                    metrics.note_retry()
+                    print(f'{fn.__name__} attempt {attempt + 1} failed, retrying in {delay:.1f}s')
+                    time.sleep(delay)
+                    continue
+                limiter.on_success()
+                retry_budget.deposit()
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,143 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import metrics
+from compact import split_turns
+
+# spans sent per question with a grading request; 0 sends the whole transcript as before
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 2))
+# long interviews are graded in batches whose spans stay under this share of the transcript;
+# the batches are graded in parallel
+RETRIEVAL_SPAN_SHARE = float(os.environ.get('RETRIEVAL_SPAN_SHARE', 0.1))
+SPAN_CHARS = int(os.environ.get('RETRIEVAL_SPAN_CHARS', 1200))
+# split batches may send a span more than once, but not the transcript over and over
+MAX_SPAN_REPEAT = 1.5
+# when the chosen spans are most of the transcript anyway, the whole text is sent
+MAX_SPAN_SHARE = 0.8
+MAX_INDEXES = 32
+BM25_K1 = 1.2
+BM25_B = 0.75
+STOPWORDS = frozenset('''a an and are as at be but by did do does for from had has have how i if in is it its me my
+    of on or so that the their them then there they this to was we were what when where which who why will with
+    you your yeah okay um uh like just really'''.split())
+GAP = '...'
+
+
+def tokenize(text):
+    return [word for word in re.findall(r"[a-z0-9']+", text.lower()) if word not in STOPWORDS]
+
+
+def split_spans(text, span_chars=SPAN_CHARS):
+    # consecutive turns up to span_chars each; a turn is never cut in half
+    spans, current, size = [], [], 0
+    for turn in split_turns(text):
+        if current and size + len(turn) > span_chars:
+            spans.append('\n'.join(current))
+            current, size = [], 0
+        current.append(turn)
+        size += len(turn) + 1
+    if current:
+        spans.append('\n'.join(current))
+    return spans
+
+
+class SpanIndex:
+    # BM25 over the spans of one transcript
+    def __init__(self, text, span_chars=SPAN_CHARS):
+        self.spans = split_spans(text, span_chars)
+        self.terms = [Counter(tokenize(span)) for span in self.spans]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 1
+        frequency = Counter(term for terms in self.terms for term in terms)
+        n = len(self.spans)
+        self.idf = {term: math.log(1 + (n - f + 0.5) / (f + 0.5)) for term, f in frequency.items()}
+
+    def score(self, i, query_terms):
+        terms = self.terms[i]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / (self.average_length or 1))
+        return sum(self.idf[t] * terms[t] * (BM25_K1 + 1) / (terms[t] + norm) for t in query_terms if t in terms)
+
+    def top(self, query, k):
+        query_terms = set(tokenize(query))
+        scores = [(self.score(i, query_terms), i) for i in range(len(self.spans))]
+        return [i for score, i in sorted(scores, key=lambda s: (-s[0], s[1]))[:k] if score > 0]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(text):
+    # built once per transcript; every grading request and batch for it shares the index
+    key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = SpanIndex(text)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def supporting_spans(index, pair, k):
+    return set(index.top(f"{pair.get('question', '')} {pair.get('answer', '')}", k))
+
+
+def span_batches(batch, text, k=RETRIEVAL_TOP_K):
+    # splits a batch of consecutive questions where their supporting spans would grow past
+    # RETRIEVAL_SPAN_SHARE of the transcript; neighbouring questions mostly share spans
+    index = get_index(text)
+    budget = max(k, int(RETRIEVAL_SPAN_SHARE * len(index.spans)))
+    batches, groups, current, spans = [], [], [], set()
+    for pair in batch:
+        needed = supporting_spans(index, pair, k)
+        if current and len(spans | needed) > budget:
+            batches.append(current)
+            groups.append(spans)
+            current, spans = [], set()
+        current.append(pair)
+        spans |= needed
+    if current:
+        batches.append(current)
+        groups.append(spans)
+    # when the questions cannot be told apart (repetitive answers), every batch would carry much
+    # the same spans; then one request with all of them is cheaper
+    sent = sum(len(index.spans[i]) for group in groups for i in group)
+    union = sum(len(index.spans[i]) for i in set().union(*groups))
+    if sent > MAX_SPAN_REPEAT * union:
+        return [batch]
+    return batches
+
+
+def relevant_text(q_and_a_arr, text, k=RETRIEVAL_TOP_K):
+    # the transcript reduced to the top-k spans for each question and its answer, in transcript
+    # order, with "..." where spans were left out
+    if not k or not text:
+        return text
+    index = get_index(text)
+    if len(index.spans) <= k:
+        return text
+    chosen = set()
+    for pair in q_and_a_arr:
+        chosen |= supporting_spans(index, pair, k)
+    parts, previous = [], -1
+    for i in sorted(chosen):
+        if i > previous + 1:
+            parts.append(GAP)
+        parts.append(index.spans[i])
+        previous = i
+    if previous < len(index.spans) - 1:
+        parts.append(GAP)
+    reduced = '\n'.join(parts)
+    if not chosen or len(reduced) > MAX_SPAN_SHARE * len(text):
+        return text
+    metrics.note_saved(len(text) - len(reduced))
+    return reduced
@@ -0,0 +1,47 @@
+import json
+import os
+
+LARGE_MODEL = 'anthropic/claude-3-5-sonnet'
+# what every stage used before routing existed
+DEFAULT_ROUTE = {'models': [LARGE_MODEL], 'max_output_size': 4000}
+# generate_question_answer never set a model or budget, so LeMUR picks its own default
+DEFAULT_ROUTES = {'generate_question_answer': {'models': [None], 'max_output_size': None}}
+# USD per 1k input and output tokens, only used for the cost estimates in the metrics;
+# models missing here are priced like the large model
+MODEL_PRICES = {
+    'anthropic/claude-3-5-sonnet': (0.003, 0.015),
+    'anthropic/claude-3-sonnet': (0.003, 0.015),
+    'anthropic/claude-3-opus': (0.015, 0.075),
+    'anthropic/claude-3-haiku': (0.00025, 0.00125),
+}
+# LEMUR_ROUTES is a JSON object, or the path of a JSON file, with a route per stage name ("*" for
+# every stage) and optional "prices", e.g.
+# {"get_skills": {"models": ["anthropic/claude-3-haiku", "anthropic/claude-3-5-sonnet"], "max_output_size": 2000}}
+LEMUR_ROUTES = os.environ.get('LEMUR_ROUTES', '')
+
+
+def load_routes(source=LEMUR_ROUTES):
+    if not source:
+        return {}
+    if source.lstrip().startswith('{'):
+        return json.loads(source)
+    with open(source) as f:
+        return json.load(f)
+
+
+routes = load_routes()
+prices = {**MODEL_PRICES, **{model: tuple(price) for model, price in routes.get('prices', {}).items()}}
+
+
+def stage_route(stage):
+    # {'models': [...], 'max_output_size': n}. The models are tried in order, and the next one
+    # only when the previous one's response does not validate (fast model first, then large).
+    route = {**DEFAULT_ROUTE, **DEFAULT_ROUTES.get(stage, {}), **routes.get('*', {}), **routes.get(stage, {})}
+    models = route['models']
+    return {'models': [models] if isinstance(models, str) or models is None else list(models),
+            'max_output_size': route['max_output_size']}
+
+
+def request_cost(model, input_tokens, output_tokens):
+    input_price, output_price = prices.get(model, prices[LARGE_MODEL])
+    return (input_tokens * input_price + output_tokens * output_price) / 1000
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from matching import pair_assessments
+
+GRADES = {'candidate': 'candidate_grade', 'interviewer': 'interviewer_grade'}
+FRAME_COLUMNS = ['interview', 'candidate', 'job', 'interviewer', 'created_at', 'position', 'skill',
+                 'candidate_grade', 'interviewer_grade']
+
+
+def grade_value(value):
+    # same rules as calculateQualityScore: whatever int() accepts counts, anything else is skipped
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+
+def item_grade(item):
+    return grade_value(item.get('grade')) if isinstance(item, dict) else None
+
+
+def item_skill(item):
+    return item.get('skill') if isinstance(item, dict) else None
+
+
+def compact(frame):
+    # grades as nullable integers (missing = skipped), repeated strings as categoricals
+    frame['candidate_grade'] = frame['candidate_grade'].astype('Int64')
+    frame['interviewer_grade'] = frame['interviewer_grade'].astype('Int64')
+    for column in ('candidate', 'job', 'interviewer', 'skill'):
+        frame[column] = frame[column].astype('category')
+    return frame
+
+
+def frame_from_results(results):
+    # results: analyze_interview/ResultStore.get dicts, optionally carrying 'interview',
+    # 'candidate', 'job', 'interviewer' and 'created_at' labels. One row per question; the
+    # two grade lists are joined by question id like ResultStore.save does.
+    rows = []
+    for n, result in enumerate(results):
+        candidate_assessment = result.get('parsed_candidate_assessment') or []
+        interviewer_audit = result.get('parsed_interviewer_audit') or []
+        labels = (result.get('interview', n), result.get('candidate', ''), result.get('job', ''),
+                  result.get('interviewer', ''), result.get('created_at'))
+        for i, (candidate_item, interviewer_item) in enumerate(pair_assessments(candidate_assessment, interviewer_audit)):
+            skill = item_skill(candidate_item) or item_skill(interviewer_item)
+            rows.append(labels + (i, skill, item_grade(candidate_item), item_grade(interviewer_item)))
+    return compact(pd.DataFrame.from_records(rows, columns=FRAME_COLUMNS))
+
+
+def frame_from_store(store, job=None, since=None, until=None):
+    # grades are already integers in the store, so no per-item normalization is needed
+    columns, rows = store.assessment_rows(job=job, since=since, until=until)
+    return compact(pd.DataFrame.from_records(rows, columns=columns))
+
+
+def quality_scores(frame, by, grade='candidate'):
+    # (total points) / (5 * number of graded questions) per group, 0 for groups without grades,
+    # i.e. calculateQualityScore applied to every group at once
+    grades = frame[GRADES[grade]]
+    grouped = grades.groupby([frame[column] for column in np.atleast_1d(by)], observed=True)
+    scores = pd.DataFrame({'points': grouped.sum(), 'questions': grouped.count()})
+    total = 5 * scores['questions']
+    scores['score'] = (scores['points'] / total.where(total > 0)).fillna(0).astype('float64')
+    return scores
+
+
+def interview_scores(frame):
+    candidate = quality_scores(frame, 'interview', 'candidate')['score']
+    interviewer = quality_scores(frame, 'interview', 'interviewer')['score']
+    return pd.DataFrame({'candidate_score': candidate, 'interviewer_score': interviewer}).fillna(0)
+
+
+def skill_scores(frame, grade='candidate'):
+    return quality_scores(frame, 'skill', grade)
+
+
+def interviewer_scores(frame):
+    # how relevant each interviewer's questions were, and how their candidates did
+    relevance = quality_scores(frame, 'interviewer', 'interviewer')
+    candidates = quality_scores(frame, 'interviewer', 'candidate')
+    return pd.DataFrame({
+        'interviews': frame.groupby('interviewer', observed=True)['interview'].nunique(),
+        'question_score': relevance['score'],
+        'candidate_score': candidates['score'],
+    })
+
+
+def weighted_scores(frame, weights, by='interview', grade='candidate', default_weight=1.0):
+    # rubric where some skills count more: sum(w * grade) / (5 * sum(w)) over graded questions;
+    # with every weight equal to 1 this is the plain quality score
+    grades = frame[GRADES[grade]].astype('float64')
+    w = frame['skill'].astype(object).map(weights).fillna(default_weight).astype('float64')
+    w = w.where(grades.notna(), 0.0)
+    keys = [frame[column] for column in np.atleast_1d(by)]
+    points = (grades.fillna(0) * w).groupby(keys, observed=True).sum()
+    total = 5 * w.groupby(keys, observed=True).sum()
+    return (points / total.where(total > 0)).fillna(0).rename('score')
+
+
+def grade_distribution(frame, by='skill', grade='candidate', normalize=False):
+    # number (or share, with normalize=True) of each grade per group, one column per grade
+    graded = frame[frame[GRADES[grade]].notna()]
+    counts = pd.crosstab(graded[by], graded[GRADES[grade]].astype('int64'))
+    if normalize:
+        counts = counts.div(counts.sum(axis=1), axis=0)
+    return counts
@@ -0,0 +1,119 @@
+import os
+import re
+
+from metrics import instrumented
+
+# set LOCAL_SEGMENTER=0 to always extract the questions with LeMUR
+LOCAL_SEGMENTER = os.environ.get('LOCAL_SEGMENTER', '1') != '0'
+# below this the speaker split is not trusted and get_questions runs as before
+SEGMENT_MIN_CONFIDENCE = float(os.environ.get('SEGMENT_MIN_CONFIDENCE', 0.6))
+MIN_QUESTIONS = 2
+# interviewers also ask by instruction ("Tell me about...") without a question mark, at the start
+# of a sentence or of a later clause ("Great, next, walk me through...", "Question 4: Tell me...")
+PROMPT = re.compile(r"(?:^|[,;:]\s*)(?:(?:so|and|okay|now|next|then|also|finally|lastly)\b,?\s*)*"
+                    r"(?:tell me|walk me|talk me|describe|explain|give me|share)\b", re.IGNORECASE)
+# interviewer turns without a question up to this many words are backchannel ("Okay, great.")
+BACKCHANNEL_WORDS = 6
+SENTENCE = re.compile(r'[^.?!]+(?:[.?!]+|$)')
+# pasted transcripts in the "Speaker A: ..." layout carry the same labels as utterances
+LABELLED_LINE = re.compile(r'^(?:speaker\s+(\w+)|([A-Z]))\s*:\s*(.+)$', re.IGNORECASE)
+
+
+def utterance_dicts(utterances):
+    # SDK Utterance objects or plain dicts (fake server, stored results)
+    rows = []
+    for u in utterances or []:
+        get = u.get if isinstance(u, dict) else lambda key: getattr(u, key, None)
+        if get('speaker') is not None and (get('text') or '').strip():
+            rows.append({'speaker': str(get('speaker')), 'text': get('text').strip(), 'start': get('start'), 'end': get('end')})
+    return rows
+
+
+def utterances_from_text(text):
+    rows = []
+    for line in (text or '').splitlines():
+        if not line.strip():
+            continue
+        match = LABELLED_LINE.match(line.strip())
+        if match is None:
+            return []
+        rows.append({'speaker': (match.group(1) or match.group(2)).upper(), 'text': match.group(3).strip(),
+                     'start': None, 'end': None})
+    return rows
+
+
+def merge_turns(utterances):
+    # consecutive utterances of one speaker are one turn
+    turns = []
+    for u in utterances:
+        if turns and turns[-1]['speaker'] == u['speaker']:
+            turns[-1]['text'] += ' ' + u['text']
+            turns[-1]['end'] = u['end']
+        else:
+            turns.append(dict(u))
+    return turns
+
+
+def sentences(text):
+    return [s.strip() for s in SENTENCE.findall(text) if s.strip()]
+
+
+def is_question(sentence):
+    return sentence.endswith('?') or PROMPT.search(sentence) is not None
+
+
+def question_density(turns):
+    # speaker -> share of their sentences that are questions
+    asked, said = {}, {}
+    for turn in turns:
+        parts = sentences(turn['text'])
+        said[turn['speaker']] = said.get(turn['speaker'], 0) + len(parts)
+        asked[turn['speaker']] = asked.get(turn['speaker'], 0) + sum(is_question(s) for s in parts)
+    return {speaker: asked[speaker] / said[speaker] for speaker in said if said[speaker]}
+
+
+def segment_interview(utterances):
+    # (q_and_a_arr, confidence). The interviewer is the speaker who asks the most questions per
+    # sentence; each of their turns with a question opens a pair, and everyone else's turns up to
+    # the next such turn are the answer. Short interviewer turns without a question ("Okay, great.")
+    # are backchannel and skipped. Longer ones still open a pair, so the answer after a question
+    # that was not recognized is not glued onto the previous one, but they count against confidence.
+    turns = merge_turns(utterances)
+    density = question_density(turns)
+    if len(density) < 2:
+        return [], 0.0
+    ranked = sorted(density.values(), reverse=True)
+    if ranked[0] == 0:
+        return [], 0.0
+    interviewer = max(density, key=density.get)
+    pairs, unsure = [], 0
+    for turn in turns:
+        if turn['speaker'] == interviewer:
+            asked = [s for s in sentences(turn['text']) if is_question(s)]
+            if asked:
+                pairs.append({'question': ' '.join(asked), 'answer': ''})
+            elif len(turn['text'].split()) > BACKCHANNEL_WORDS:
+                pairs.append({'question': turn['text'], 'answer': ''})
+                unsure += 1
+        elif pairs:
+            pairs[-1]['answer'] = (pairs[-1]['answer'] + ' ' + turn['text']).strip()
+    answered = [pair for pair in pairs if pair['answer']]
+    if len(answered) < MIN_QUESTIONS:
+        return answered, 0.0
+    # how clearly one speaker is the one asking, times how many of their questions got an answer
+    # and how many of the pairs opened with a recognized question
+    separation = (ranked[0] - ranked[1]) / ranked[0]
+    return answered, separation * len(answered) / len(pairs) * (len(pairs) - unsure) / len(pairs)
+
+
+@instrumented('segment_questions')
+def segment_questions(utterances):
+    # the Q&A array from speaker labels, or None when LeMUR should extract it instead
+    if not LOCAL_SEGMENTER or not utterances:
+        return None
+    q_and_a_arr, confidence = segment_interview(utterances)
+    if confidence < SEGMENT_MIN_CONFIDENCE:
+        print(f'Speaker segmentation confidence {confidence:.2f}, extracting questions with LeMUR')
+        return None
+    print(f'Segmented {len(q_and_a_arr)} questions from speaker labels (confidence {confidence:.2f})')
+    return q_and_a_arr
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline import PASTED_TRANSCRIPT_ID, run_pipeline
+from store import get_store, to_jsonable
+
+# threads shared by every analysis in the process, whichever session or client started it
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 16))
+# stage calls and the requests stages fan out, in flight across all analyses; the rest wait for a slot
+ANALYSIS_MAX_REQUESTS = int(os.environ.get('ANALYSIS_MAX_REQUESTS', 16))
+# interviews analyzed at once; later submissions stay queued until one finishes
+ANALYSIS_MAX_ACTIVE = int(os.environ.get('ANALYSIS_MAX_ACTIVE', 8))
+SERVER_PORT = int(os.environ.get('ANALYSIS_SERVER_PORT', 8767))
+# finished jobs are forgotten after this long
+JOB_TTL = 60 * 60
+
+
+class AnalysisJob:
+    def __init__(self, transcript_id, name=None):
+        self.id = uuid.uuid4().hex
+        self.transcript_id = transcript_id
+        self.name = name or transcript_id
+        self.status = 'queued'
+        # stage name -> result, filled in as stages finish so the UI can show partial results
+        self.stages = {}
+        # grading stage name -> items graded so far, batch by batch, until the stage finishes
+        self.graded = {}
+        self.result = None
+        self.error = None
+        self.interview_id = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        # stages is written by the event loop thread while UI sessions and HTTP clients read it
+        self._lock = threading.Lock()
+
+    def stage_done(self, name, result):
+        with self._lock:
+            self.stages[name] = result
+            self.graded.pop(name, None)
+
+    def add_graded(self, name, items):
+        with self._lock:
+            if name not in self.stages:
+                self.graded.setdefault(name, []).extend(items)
+
+    def snapshot(self):
+        # (finished stages, items graded so far by unfinished grading stages), copied under the lock
+        with self._lock:
+            return dict(self.stages), {name: list(items) for name, items in self.graded.items()}
+
+    def done(self):
+        return self.finished_at is not None
+
+    def to_json(self):
+        return {
+            'id': self.id, 'name': self.name, 'status': self.status, 'transcript_id': self.transcript_id,
+            'stages_done': sorted(self.snapshot()[0]), 'error': self.error, 'interview_id': self.interview_id,
+            'created_at': self.created_at, 'started_at': self.started_at, 'finished_at': self.finished_at,
+            'result': to_jsonable(self.result) if self.result is not None else None,
+        }
+
+
+class AnalysisServer:
+    # One event loop and one bounded thread pool for the whole process. Every Streamlit
+    # session (and every HTTP client) submits analyses here and polls the job id, instead of
+    # running its own event loop and executor inside the script run. The API key travels with
+    # each job down to the backend client, so nothing touches the global aai.settings.
+    def __init__(self, workers=ANALYSIS_WORKERS, max_requests=ANALYSIS_MAX_REQUESTS, max_active=ANALYSIS_MAX_ACTIVE):
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis'))
+        self._requests = asyncio.Semaphore(max_requests)
+        self._active = asyncio.Semaphore(max_active)
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    def submit(self, transcript_id, jd, skills, api_key, transcript_text='', fused=False, pipelined=False,
+               long_mode=None, save=None, name=None, previous=None):
+        # save: None, or ResultStore.save labels (candidate, job, interviewer) to file the result under;
+        # previous: an earlier result for this transcript, so only invalidated stages run again
+        job = AnalysisJob(transcript_id, name)
+        with self._lock:
+            self._prune()
+            self.jobs[job.id] = job
+        coro = self._run(job, transcript_id, jd, skills, api_key, transcript_text, fused, pipelined, long_mode, save, previous)
+        job.future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def active(self):
+        with self._lock:
+            return [job for job in self.jobs.values() if not job.done()]
+
+    async def _run(self, job, transcript_id, jd, skills, api_key, transcript_text, fused, pipelined, long_mode, save, previous):
+        async with self._active:
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                result = await run_pipeline(transcript_id, jd, skills, api_key, transcript_text, semaphore=self._requests,
+                                            fused=fused, on_stage_done=job.stage_done, long_mode=long_mode,
+                                            pipelined=pipelined, previous=previous, on_graded=job.add_graded)
+                if save is not None:
+                    job.interview_id = await asyncio.to_thread(get_store().save, result, **save)
+            except Exception as e:
+                print(f'Analysis {job.id} of {job.name} failed: {e}')
+                job.status = 'error'
+                job.error = str(e)
+                job.finished_at = time.time()
+                raise
+        job.result = result
+        job.status = 'completed'
+        job.finished_at = time.time()
+        return result
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [i for i, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+
+class Handler(BaseHTTPRequestHandler):
+    # POST /analyses with a JSON body and the AssemblyAI key in the authorization header
+    # returns a job id; GET /analyses/<id> returns its status, and the result once completed
+    server_app = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        match = re.fullmatch(r'/analyses/(\w+)', self.path)
+        job = self.server_app.get(match.group(1)) if match else None
+        if job is None:
+            return self.send_json(404, {'error': f'Not found: {self.path}'})
+        self.send_json(200, job.to_json())
+
+    def do_POST(self):
+        if self.path != '/analyses':
+            return self.send_json(404, {'error': f'Not found: {self.path}'})
+        api_key = self.headers.get('authorization')
+        if not api_key:
+            return self.send_json(401, {'error': 'An AssemblyAI API key is required in the authorization header'})
+        length = int(self.headers.get('content-length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) if length else b'{}')
+            # re-analysis of a stored interview, e.g. with an edited job description or skills list
+            previous = get_store().get(body['previous_interview']) if body.get('previous_interview') else None
+            if previous is not None:
+                body.setdefault('transcript_id', previous['transcript_id'])
+                body.setdefault('transcript_text', previous['transcript_text'])
+            if not body.get('transcript_id') and not body.get('transcript_text'):
+                raise ValueError('transcript_id, transcript_text or previous_interview is required')
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        save = {key: body.get(key, '') for key in ('candidate', 'job', 'interviewer')} if body.get('save') else None
+        job = self.server_app.submit(body.get('transcript_id') or PASTED_TRANSCRIPT_ID, body.get('jd', ''),
+                                     body.get('skills', ''), api_key, body.get('transcript_text', ''),
+                                     fused=bool(body.get('fused')), pipelined=bool(body.get('pipelined')),
+                                     long_mode=body.get('long_mode'), save=save, name=body.get('name'), previous=previous)
+        self.send_json(202, {'id': job.id, 'status': job.status})
+
+
+def start_http_server(server_app, host='127.0.0.1', port=SERVER_PORT):
+    handler = type('AnalysisHandler', (Handler,), {'server_app': server_app})
+    http_server = ThreadingHTTPServer((host, port), handler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    print(f'Analysis server listening on {host}:{http_server.server_address[1]}')
+    return http_server
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_server():
+    global _server
+    if _server is None:
+        with _server_lock:
+            if _server is None:
+                _server = AnalysisServer()
+    return _server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shared analysis service: submit interviews, poll job ids.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args(argv)
+    http_server = start_http_server(get_server(), args.host, args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        http_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from matching import calculateQualityScore, pair_assessments
+
+DEFAULT_STORE_PATH = os.environ.get('RESULTS_DB_PATH', 'results.sqlite')
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS interviews (
+        id INTEGER PRIMARY KEY,
+        transcript_id TEXT,
+        candidate TEXT NOT NULL,
+        job TEXT NOT NULL,
+        interviewer TEXT NOT NULL DEFAULT '',
+        created_at REAL NOT NULL,
+        jd TEXT,
+        skills TEXT,
+        candidate_score REAL,
+        interviewer_score REAL,
+        transcript_text TEXT,
+        summary_paragraph TEXT,
+        summary_topics TEXT,
+        question_answer TEXT,
+        questions_source TEXT
+    );
+    CREATE INDEX IF NOT EXISTS interviews_candidate ON interviews (candidate, created_at);
+    CREATE INDEX IF NOT EXISTS interviews_job ON interviews (job, created_at);
+    CREATE INDEX IF NOT EXISTS interviews_created_at ON interviews (created_at);
+    CREATE INDEX IF NOT EXISTS interviews_interviewer ON interviews (interviewer, created_at);
+
+    CREATE TABLE IF NOT EXISTS assessments (
+        interview_id INTEGER NOT NULL REFERENCES interviews (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT,
+        skill TEXT,
+        candidate_grade INTEGER,
+        interviewer_grade INTEGER,
+        PRIMARY KEY (interview_id, position)
+    );
+    -- covers the per-skill aggregates without touching the question/answer text
+    CREATE INDEX IF NOT EXISTS assessments_skill ON assessments (skill, candidate_grade, interviewer_grade);
+'''
+
+ADDED_COLUMNS = {'interviewer': "TEXT NOT NULL DEFAULT ''", 'jd': 'TEXT', 'skills': 'TEXT',
+                 'questions_source': 'TEXT'}
+
+PERIODS = {'day': '%Y-%m-%d', 'week': '%Y-%W', 'month': '%Y-%m', 'year': '%Y'}
+
+
+def question_answer_dicts(question_answer):
+    return [{'question': q.question, 'answer': q.answer} if hasattr(q, 'question') else q for q in question_answer or []]
+
+
+def to_jsonable(result):
+    # question_answer holds SDK objects; everything else is already plain JSON
+    result = dict(result)
+    result['question_answer'] = question_answer_dicts(result['question_answer'])
+    return result
+
+
+def grade_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def job_title(jd):
+    # the first line of a job description is almost always the title
+    lines = [line.strip() for line in (jd or '').splitlines() if line.strip()]
+    return lines[0][:120] if lines else ''
+
+
+class ResultStore:
+    # Every finished analysis is kept here, one row per interview plus one row per graded
+    # question, so reports across thousands of interviews are SQL aggregates instead of
+    # re-running LeMUR or reading result files.
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(interviews)')]
+        # stores created before interviewers, the job description and skills, and where the
+        # questions came from were recorded
+        for column, definition in ADDED_COLUMNS.items():
+            if columns and column not in columns:
+                self._conn.execute(f'ALTER TABLE interviews ADD COLUMN {column} {definition}')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def save(self, result, candidate='', job='', created_at=None, interviewer=''):
+        result = to_jsonable(result)
+        candidate_assessment = result['parsed_candidate_assessment'] or []
+        interviewer_audit = result['parsed_interviewer_audit'] or []
+        inputs = result.get('inputs') or {}
+        rows = []
+        for i, (item, audit) in enumerate(pair_assessments(candidate_assessment, interviewer_audit)):
+            item, audit = item or {}, audit or {}
+            rows.append((i, item.get('question') or audit.get('question', ''), item.get('answer', ''),
+                         item.get('skill') or audit.get('skill'), grade_or_none(item.get('grade')), grade_or_none(audit.get('grade'))))
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO interviews (transcript_id, candidate, job, interviewer, created_at, jd, skills, candidate_score, '
+                'interviewer_score, transcript_text, summary_paragraph, summary_topics, question_answer, questions_source) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (result.get('transcript_id'), candidate, job, interviewer, created_at or time.time(), inputs.get('jd'),
+                 inputs.get('skills'), calculateQualityScore(candidate_assessment) * 100, calculateQualityScore(interviewer_audit) * 100,
+                 result.get('transcript_text'), result.get('summary_paragraph'), result.get('summary_topics'),
+                 json.dumps(result['question_answer']), result.get('questions_source'))
+            )
+            interview_id = cursor.lastrowid
+            self._conn.executemany(
+                'INSERT INTO assessments (interview_id, position, question, answer, skill, candidate_grade, interviewer_grade) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(interview_id,) + row for row in rows]
+            )
+            self._conn.commit()
+        return interview_id
+
+    def get(self, interview_id):
+        # rebuilds the dict analyze_interview returned, with question_answer as plain dicts
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT transcript_id, transcript_text, summary_paragraph, summary_topics, question_answer, jd, skills, questions_source '
+                'FROM interviews WHERE id = ?', (interview_id,)
+            ).fetchone()
+            items = self._conn.execute(
+                'SELECT question, answer, skill, candidate_grade, interviewer_grade FROM assessments '
+                'WHERE interview_id = ? ORDER BY position', (interview_id,)
+            ).fetchall()
+        if row is None:
+            return None
+        return {
+            'transcript_id': row[0],
+            'transcript_text': row[1],
+            'q_and_a_arr': [{'question': q, 'answer': a} for q, a, _, _, _ in items],
+            'parsed_candidate_assessment': [{'question': q, 'answer': a, 'skill': s, 'grade': c} for q, a, s, c, _ in items],
+            'parsed_interviewer_audit': [{'question': q, 'skill': s, 'grade': i} for q, _, s, _, i in items],
+            'summary_paragraph': row[2],
+            'summary_topics': row[3],
+            'question_answer': json.loads(row[4] or '[]'),
+            'inputs': {'jd': row[5], 'skills': row[6]} if row[5] is not None else None,
+            'questions_source': row[7],
+        }
+
+    def list_interviews(self, candidate=None, job=None, limit=100):
+        where, params = self._filters(candidate=candidate, job=job)
+        return self._query(
+            f'SELECT id, candidate, job, interviewer, created_at, candidate_score, interviewer_score FROM interviews {where} '
+            'ORDER BY created_at DESC LIMIT ?', params + [limit]
+        )
+
+    def skill_averages(self, job=None, since=None, until=None):
+        where, params = self._filters(job=job, since=since, until=until)
+        if where:
+            where = f'WHERE a.interview_id IN (SELECT id FROM interviews {where})'
+        return self._query(
+            'SELECT a.skill, COUNT(*) AS questions, AVG(a.candidate_grade) AS candidate_grade, '
+            f'AVG(a.interviewer_grade) AS interviewer_grade FROM assessments a {where} '
+            'GROUP BY a.skill ORDER BY a.skill', params
+        )
+
+    def score_trend(self, job=None, period='month'):
+        # average candidate and interviewer scores per day/week/month/year
+        where, params = self._filters(job=job)
+        return self._query(
+            f"SELECT strftime('{PERIODS[period]}', created_at, 'unixepoch') AS period, COUNT(*) AS interviews, "
+            'AVG(candidate_score) AS candidate_score, AVG(interviewer_score) AS interviewer_score '
+            f'FROM interviews {where} GROUP BY period ORDER BY period', params
+        )
+
+    def assessment_rows(self, job=None, since=None, until=None):
+        # raw (columns, rows) for building a scoring frame without a dict per row
+        where, params = self._filters(job=job, since=since, until=until)
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT a.interview_id AS interview, i.candidate, i.job, i.interviewer, i.created_at, a.position, a.skill, '
+                f'a.candidate_grade, a.interviewer_grade FROM assessments a JOIN interviews i ON i.id = a.interview_id {where}',
+                params
+            )
+            return [c[0] for c in cursor.description], cursor.fetchall()
+
+    def _filters(self, candidate=None, job=None, since=None, until=None):
+        clauses, params = [], []
+        for clause, value in (('candidate = ?', candidate), ('job = ?', job), ('created_at >= ?', since), ('created_at < ?', until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return ('WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def _query(self, sql, params):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store():
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = ResultStore()
+    return _default_store
@@ -0,0 +1,21 @@
+from analysis import QUESTION_SCHEMA, parse_json
+from jsonstream import JsonArrayStream
+
+
+def test_unbalanced_brace_in_prose():
+    response = 'Here are the pairs (format {question, answer):\n[{"question":"Q1","answer":"A1"},{"question":"Q2","answer":"A2"}]'
+    assert parse_json(response, QUESTION_SCHEMA) == [{'question': 'Q1', 'answer': 'A1'}, {'question': 'Q2', 'answer': 'A2'}]
+
+
+def test_unclosed_element_keeps_the_rest():
+    response = ('[{"question":"Q1","answer":"A1"},{"question":"Q2","answer":"A2"],'
+                '{"question":"Q3","answer":"A3"},{"question":"Q4","answer":"A4"}]')
+    assert [item['question'] for item in parse_json(response, QUESTION_SCHEMA)] == ['Q1', 'Q3', 'Q4']
+
+
+def test_trailing_comma_and_truncated_tail():
+    stream = JsonArrayStream(QUESTION_SCHEMA)
+    assert stream.feed('[{"question":"Q1","answer":"A1",},{"question":"Q2","ans') == [{'question': 'Q1', 'answer': 'A1'}]
+    assert stream.truncated
+    assert stream.feed('wer":"A2"}]') == [{'question': 'Q2', 'answer': 'A2'}]
+    assert not stream.truncated
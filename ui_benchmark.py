@@ -0,0 +1,94 @@
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import fake_server
+import metrics
+
+# Runs main.py headless (Streamlit's AppTest) against fake_server.py and checks the script's own
+# timings against UI_STARTUP_BUDGET and UI_RERUN_BUDGET. Start it as a fresh process: nothing of the
+# app is imported before the first run, so that run pays for the imports like a cold start does.
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def page_runs(stage):
+    return [record['wall_time'] for record in metrics.recorder.snapshot() if record['stage'] == stage]
+
+
+def format_runs(stage, runs, budget):
+    if not runs:
+        return f'{stage:<11} no runs'
+    over = sum(seconds > budget for seconds in runs)
+    return (f'{stage:<11} runs {len(runs):>3}  p50 {metrics.percentile(runs, 50):.3f}s  max {max(runs):.3f}s  '
+            f'budget {budget:.2f}s  over {over}')
+
+
+def run_app(timeout, reruns):
+    # (startup runs, rerun runs, error); main.py records each of its runs in metrics.recorder
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(MAIN, default_timeout=timeout)
+    app.run()
+    startup = page_runs('ui_startup')
+
+    # analyze one synthetic interview (the fake server treats unknown transcript ids as finished
+    # transcripts); the results page polls until the analysis is done
+    app.text_input[0].input('benchmark')
+    app.text_input[1].input('ui-bench-0')
+    app.text_area[1].input('Backend engineer')
+    app.text_area[2].input('Python, Communication, System Design')
+    app.button[0].click()
+    start = time.perf_counter()
+    app.run()
+    while not app.session_state.complete and not app.exception and time.perf_counter() - start < timeout:
+        app.run()
+    if app.exception or not app.session_state.complete:
+        return startup, [], f'analysis did not finish: {app.exception}'
+
+    # the first results page loads its components; the reruns after that are what a click costs,
+    # every other one turning a page of the transcript
+    app.run()
+    metrics.recorder.clear()
+    for n in range(reruns):
+        pickers = [number for number in app.number_input if number.label.startswith('Page')]
+        if pickers and n % 2:
+            picker = pickers[n % len(pickers)]
+            picker.set_value(picker.value % picker.max + 1)
+        app.run()
+    return startup, page_runs('ui_rerun'), app.exception or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure Streamlit startup and rerun time of main.py against the fake server')
+    parser.add_argument('--reruns', type=int, default=20, help='reruns of the results page to time')
+    parser.add_argument('--questions', type=int, default=30, help='Q&A pairs in the fake server\'s synthetic transcript')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds the analysis may take')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='show the app\'s own print output')
+    args = parser.parse_args(argv)
+
+    _, base_url, _ = fake_server.start_server(lemur_latency='fixed:0.01', transcribe_latency='fixed:0.01', seed=args.seed,
+                                              num_questions=args.questions)
+    # read by the app's modules when main.py first imports them
+    os.environ['ASSEMBLYAI_BASE_URL'] = base_url
+    os.environ['LEMUR_CACHE'] = '0'
+    os.environ['RESULTS_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'results.sqlite')
+
+    with open(os.devnull, 'w') as devnull:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with quiet:
+            startup, reruns, error = run_app(args.timeout, args.reruns)
+    if error:
+        print(f'UI benchmark failed: {error}')
+        return 1
+
+    print(format_runs('ui_startup', startup, metrics.UI_STARTUP_BUDGET))
+    print(format_runs('ui_rerun', reruns, metrics.UI_RERUN_BUDGET))
+    over = [s for s in startup if s > metrics.UI_STARTUP_BUDGET] + [s for s in reruns if s > metrics.UI_RERUN_BUDGET]
+    return 1 if over or not startup or not reruns else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())